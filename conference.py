@@ -15,39 +15,69 @@ __author__ = 'wesc+api@google.com (Wesley Chun) and Krishna Pandey'
 
 
 from datetime import datetime
-import copy
+import csv
+import hashlib
+import json
+import logging
+import operator
+import random
+import re
+import time
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
+from protorpc import protojson
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
-from google.appengine.api import memcache
-from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import ConflictException
 from models import Profile
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import BooleanMessage
+from models import RegistrationRequestForm
+from models import RegistrationResultForm
+from models import RegistrationResultForms
+from models import Attendee
+from models import AttendeeForm
+from models import AttendeeForms
 from models import Conference
 from models import ConferenceForm
+from models import SeatShard
 from models import ConferenceForms
+from models import ConferenceSummaryForm
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 from models import TeeShirtSize
 from models import StringMessage
 from models import Session
 from models import SessionForm
+from models import Speaker
+from models import SpeakerSessions
 from models import SessionForms
+from models import ScheduleTimeline
+from models import ScheduleConflictForm
+from models import ScheduleConflictForms
+from models import SearchDocument
 from models import SessionQueryForm
 from models import SessionQueryForms
 from models import WishListRequestForm
 from models import WishList
 from models import FeaturedSpeakerMessage
+from models import FacetCounts
+from models import FieldStats
+from models import FacetValueForm
+from models import FacetForm
+from models import FacetForms
+from models import LowSeatsIndex
+from models import AnnouncementSnapshot
+from models import QueryPlanForm
 
 from utils import getUserId
 
@@ -57,6 +87,84 @@ EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 MEMCACHE_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER"
+MEMCACHE_CONF_FEATURED_SPEAKER_KEY = "FEATURED_SPEAKER:%s"
+# a memcache miss on an announcement recomputes it at most once per interval
+ANNOUNCEMENT_REFRESH_INTERVAL = 60  # seconds
+# read-through cache of rendered ConferenceForms, keyed by websafeConferenceKey
+MEMCACHE_CONFERENCE_KEY = "CONFERENCE:%s"
+MEMCACHE_CONFERENCE_TTL = 120   # seconds
+MEMCACHE_CONFERENCE_HITS_KEY = "CONFERENCE_CACHE_HITS"
+MEMCACHE_CONFERENCE_MISSES_KEY = "CONFERENCE_CACHE_MISSES"
+# rendered facet counts of the FIELDS, dropped whenever they change
+MEMCACHE_FACETS_KEY = "CONFERENCE_FACETS"
+# Profile reads that the per-request memo in _getProfileFromUser kept
+# from reaching memcache or the datastore
+MEMCACHE_PROFILE_READS_AVOIDED_KEY = "PROFILE_READS_AVOIDED"
+# seats of a conference are split over this many SeatShard entities; the
+# total is cached in memcache and copied back to Conference.seatsAvailable
+# by a task that runs at most once per SEATS_SYNC_INTERVAL seconds
+SEAT_SHARDS = 10
+MEMCACHE_SEATS_KEY = "SEATS:%s"
+MEMCACHE_SEATS_TTL = 60     # seconds
+SEATS_SYNC_INTERVAL = 10    # seconds
+# conferences with 1 to LOW_SEATS_THRESHOLD seats left are announced as
+# nearly sold out; the set is kept in one LowSeatsIndex entity
+LOW_SEATS_THRESHOLD = 5
+LOW_SEATS_INDEX_ID = 'announcement'
+# conferences booked per transaction by registerForConferencesBatch
+MAX_BATCH_REGISTRATIONS = 10
+# datastore batch size when streaming results through an in-memory filter
+QUERY_BATCH_SIZE = 200
+# Conference fields read by queryConferences with view=summary
+CONFERENCE_SUMMARY_FIELDS = ['name', 'city', 'startDate', 'endDate',
+                             'maxAttendees', 'seatsAvailable']
+# upper bound (and default) for the number of items returned per page
+MAX_PAGE_SIZE = 100
+# conferences read per page when filters are checked in memory; a page
+# that reaches it is returned short, with a token to carry on from there
+MAX_SCAN_PER_PAGE = 1000
+# confirmation emails wait in this pull queue until a cron job sends them
+# in batches, one email per organizer
+CONFIRMATION_EMAIL_QUEUE = 'confirmation-email'
+# new sessions of a conference within one interval share a single named
+# featured speaker task, run at the end of the interval
+FEATURED_SPEAKER_INTERVAL = 10  # seconds
+# text fields searched per kind, with the weight of a term found in each
+SEARCH_FIELDS = {
+    'Conference': {'name': 3, 'description': 1, 'city': 1, 'topics': 1},
+    'Session': {'name': 3, 'highlights': 1, 'speaker': 1, 'typeOfSession': 1},
+}
+SEARCH_STOPWORDS = frozenset(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'by',
+    'for', 'from', 'in', 'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with'])
+# terms kept per document (the heaviest), terms used per query, and the
+# number of matches ranked per search
+SEARCH_MAX_TERMS = 200
+SEARCH_MAX_QUERY_TERMS = 5
+SEARCH_MAX_RESULTS = 1000
+# longer terms are left out; indexed strings are limited to 1500 bytes
+SEARCH_MAX_TERM_BYTES = 500
+# ranked keys of a search, kept so its later pages skip fetching and
+# ranking the matches again
+MEMCACHE_SEARCH_KEY = "SEARCH:%s"
+MEMCACHE_SEARCH_TTL = 120   # seconds
+# FieldStats changes wait in this pull queue, tagged by kind, until a cron
+# job folds a batch of them into the kind's FieldStats in one transaction
+FIELD_STATS_QUEUE = 'field-stats'
+FIELD_STATS_BATCH = 1000
+FIELD_STATS_LEASE = 60  # seconds
+# folding waits while a recount runs, unless it started longer ago than this
+FIELD_STATS_REBUILD_TIMEOUT = 600   # seconds
+# values counted per field; rarer values only add to the field's others
+STATS_MAX_VALUES = 100
+# ScheduleTimeline times count minutes from here
+SCHEDULE_EPOCH = datetime(1970, 1, 1)
+# entities written per put_multi by the bulk import, and the row fields
+# it reads for each kind
+IMPORT_CHUNK_SIZE = 100
+IMPORT_CONFERENCE_FIELDS = ['name', 'description', 'organizerUserId', 'topics',
+                            'city', 'startDate', 'endDate', 'maxAttendees']
+IMPORT_SESSION_FIELDS = ['name', 'highlights', 'speaker', 'duration',
+                         'typeOfSession', 'date', 'startTime']
 
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
@@ -76,6 +184,16 @@ OPERATORS = {
             'NE':   '!='
             }
 
+# python equivalents of OPERATORS, for filters checked in memory
+PY_OPERATORS = {
+            '=':    operator.eq,
+            '>':    operator.gt,
+            '>=':   operator.ge,
+            '<':    operator.lt,
+            '<=':   operator.le,
+            '!=':   operator.ne
+            }
+
 FIELDS =    {
             'CITY': 'city',
             'TOPIC': 'topics',
@@ -90,6 +208,24 @@ SESSIONFIELDS =    {
             'STARTTIME': 'startTime',
             }
 
+# (field, converter) pairs the _copy*ToForm helpers copy from an entity to
+# its outbound form, resolved once here rather than per entity with
+# all_fields()/hasattr and field name comparisons. check_initialized is
+# not run per form: only SessionForm.name is required, and _createSession
+# already refuses sessions without one.
+CONFERENCE_FORM_FIELDS = [
+    (field.name, str if field.name.endswith('Date') else None)
+    for field in ConferenceForm.all_fields() if field.name in Conference._properties]
+
+SESSION_FORM_FIELDS = [
+    (field.name, str if field.name in ('startTime', 'date') else None)
+    for field in SessionForm.all_fields() if field.name in Session._properties]
+
+PROFILE_FORM_FIELDS = [
+    (field.name, (lambda size: getattr(TeeShirtSize, size))
+        if field.name == 'teeShirtSize' else None)
+    for field in ProfileForm.all_fields() if field.name in Profile._properties]
+
 CONF_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
@@ -100,6 +236,34 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+ATTENDEES_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    limit=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+SPEAKER_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    speaker=messages.StringField(1),
+    limit=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
+SESSIONS_AT_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    time=messages.StringField(2),
+)
+
+SEARCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    query=messages.StringField(1),
+    limit=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+    websafeConferenceKey=messages.StringField(4),
+)
+
 SESSION_GET_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey = messages.StringField(1),
@@ -120,24 +284,51 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
+    def _copyConferenceToForm(self, conf, displayName=None):
+        """Copy relevant fields from Conference to ConferenceForm. displayName
+        is only needed for conferences that don't store their organizer's."""
         cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        for name, convert in CONFERENCE_FORM_FIELDS:
+            value = getattr(conf, name)
+            if convert:
+                value = convert(value)
+            if value is not None:
+                setattr(cf, name, value)
+        cf.websafeKey = conf.key.urlsafe()
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
         return cf
 
 
+    def _copyConferenceToSummary(self, conf, known=None):
+        """Copy the summary fields of a (projected) Conference to a
+        ConferenceSummaryForm. known supplies values that weren't
+        projected because the query filtered them for equality."""
+        known = known or {}
+        cs = ConferenceSummaryForm(websafeKey=conf.key.urlsafe())
+        for name in CONFERENCE_SUMMARY_FIELDS:
+            value = known[name] if name in known else getattr(conf, name)
+            # convert Date to date string; just copy others
+            if value is not None and name.endswith('Date'):
+                value = str(value)
+            setattr(cs, name, value)
+        return cs
+
+
+    def _summaryProjection(self, pushed, residual):
+        """Return the Conference properties to project for a summary query
+        with the given planned filters, or None if full entities are needed
+        (a filter checked in memory reads a property outside the summary,
+        or an inequality on repeated topics would repeat results)."""
+        if any(f["field"] not in CONFERENCE_SUMMARY_FIELDS for f in residual):
+            return None
+        if any(f["field"] == "topics" and f["operator"] != "=" for f in pushed):
+            return None
+        equal = set(f["field"] for f in pushed if f["operator"] == "=")
+        return [getattr(Conference, name) for name in CONFERENCE_SUMMARY_FIELDS
+                if name not in equal]
+
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -152,7 +343,6 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -160,6 +350,46 @@ class ConferenceApi(remote.Service):
                 data[df] = DEFAULTS[df]
                 setattr(request, df, DEFAULTS[df])
 
+        self._conferenceEntityData(data)
+        # generate Profile Key based on user ID and Conference
+        # ID based on Profile key get Conference key from ID
+        p_key = ndb.Key(Profile, user_id)
+        prof_future = p_key.get_async()
+        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
+        c_key = ndb.Key(Conference, c_id, parent=p_key)
+        data['key'] = c_key
+        data['organizerUserId'] = request.organizerUserId = user_id
+        # list views show the organizer's name without reading the Profile
+        data['organizerDisplayName'] = request.organizerDisplayName = getattr(
+            prof_future.get_result(), 'displayName', None)
+
+        # create Conference with its seat shards, send email to organizer
+        # confirming creation of Conference & return (modified) ConferenceForm
+        conf = Conference(**data)
+        shards = ndb.put_multi_async(self._newSeatShards(c_key, data['seatsAvailable']))
+        self._putConference(conf, user.email(), repr(request))
+        for shard in shards:
+            shard.get_result()
+
+        return request
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _putConference(conf, email, conferenceInfo):
+        """Save a new Conference with its search terms and queue its
+        confirmation email, which is only sent if the Conference was saved."""
+        ndb.put_multi([conf, ConferenceApi._searchDocument(conf)])
+        taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE).add(taskqueue.Task(
+            payload=json.dumps({'email': email, 'conferenceInfo': conferenceInfo}),
+            method='PULL'), transactional=True)
+        ConferenceApi._recordFieldStats('Conference',
+            added=[ConferenceApi._fieldValues(conf, FIELDS.values())])
+
+
+    @staticmethod
+    def _conferenceEntityData(data):
+        """Turn new conference data into Conference property values."""
         # convert dates from strings to Date objects; set month based on start_date
         if data['startDate']:
             data['startDate'] = datetime.strptime(data['startDate'][:10], "%Y-%m-%d").date()
@@ -172,27 +402,10 @@ class ConferenceApi(remote.Service):
         # set seatsAvailable to be same as maxAttendees on creation
         if data["maxAttendees"] > 0:
             data["seatsAvailable"] = data["maxAttendees"]
-        # generate Profile Key based on user ID and Conference
-        # ID based on Profile key get Conference key from ID
-        p_key = ndb.Key(Profile, user_id)
-        c_id = Conference.allocate_ids(size=1, parent=p_key)[0]
-        c_key = ndb.Key(Conference, c_id, parent=p_key)
-        data['key'] = c_key
-        data['organizerUserId'] = request.organizerUserId = user_id
-
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
-        Conference(**data).put()
-        # TODO 2: add confirmation email sending task to queue
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
-
-        return request
+        return data
 
 
-    @ndb.transactional()
+    @ndb.transactional(xg=True)
     def _updateConferenceObject(self, request):
         user = endpoints.get_current_user()
         if not user:
@@ -214,9 +427,30 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        old_values = self._fieldValues(conf, FIELDS.values())
+
+        # seats are what maxAttendees leaves after registrations; a form
+        # sent back unchanged is fine, an edit is not. The shards are only
+        # read for a value that isn't the stored one: reading them joins
+        # their groups to this transaction
+        if (request.seatsAvailable is not None and
+                request.seatsAvailable != conf.seatsAvailable and
+                request.seatsAvailable != self._getSeatsAvailable(conf)):
+            raise endpoints.BadRequestException(
+                'seatsAvailable follows maxAttendees; update maxAttendees instead.')
+        seats_delta = (request.maxAttendees or 0) - (conf.maxAttendees or 0)
+        shards = []
+        if request.maxAttendees is not None and seats_delta:
+            shards = self._resizeSeatShards(conf, seats_delta)
+            conf.seatsAvailable = sum(sh.seatsAvailable for sh in shards)
+            ndb.get_context().call_on_commit(
+                lambda: self._seatsChanged(conf.key, seats_delta))
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            if field.name in ('organizerDisplayName', 'seatsAvailable'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -227,9 +461,16 @@ class ConferenceApi(remote.Service):
                         conf.month = data.month
                 # write to Conference object
                 setattr(conf, field.name, data)
-        conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        if conf.organizerDisplayName is None:
+            # saved before the name was stored on conferences; the Profile
+            # is in the conference's entity group
+            conf.organizerDisplayName = getattr(conf.key.parent().get(),
+                'displayName', None)
+        ndb.put_multi([conf, self._searchDocument(conf)] + shards)
+        self._invalidateConferenceCache(request.websafeConferenceKey)
+        self._recordFieldStats('Conference', removed=[old_values],
+            added=[self._fieldValues(conf, FIELDS.values())])
+        return self._copyConferenceToForm(conf)
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
@@ -252,14 +493,38 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        wsck = request.websafeConferenceKey
+        # serve the rendered form from memcache when we have it
+        cached = memcache.get(MEMCACHE_CONFERENCE_KEY % wsck)
+        # count hits and misses without waiting for the counters
+        if cached:
+            memcache.Client().incr_async(MEMCACHE_CONFERENCE_HITS_KEY,
+                initial_value=0)
+            return protojson.decode_message(ConferenceForm, cached)
+        memcache.Client().incr_async(MEMCACHE_CONFERENCE_MISSES_KEY,
+            initial_value=0)
+
+        # get Conference object; bail if not found
+        conf = ndb.Key(urlsafe=wsck).get()
         if not conf:
             raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+                'No conference found with key: %s' % wsck)
+        names = self._getOrganizerNames([conf])
+        cf = self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+        # the entity's copy of seatsAvailable trails registrations slightly
+        cf.seatsAvailable = self._getSeatsAvailable(conf)
+        memcache.set(MEMCACHE_CONFERENCE_KEY % wsck,
+            protojson.encode_message(cf), time=MEMCACHE_CONFERENCE_TTL)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return cf
+
+
+    @staticmethod
+    def _invalidateConferenceCache(wsck):
+        """Drop the cached ConferenceForm for a conference. Inside a
+        transaction this happens only once the transaction commits."""
+        ndb.get_context().call_on_commit(
+            lambda: memcache.delete(MEMCACHE_CONFERENCE_KEY % wsck))
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -273,60 +538,68 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException('Authorization required')
         user_id =  getUserId(user)
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs = Conference.query(ancestor=ndb.Key(Profile, user_id)).fetch()
+        names = self._getOrganizerNames(confs)
         # return set of ConferenceForm objects per Conference
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
+            items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+                   for conf in confs]
         )
 
 
-    def _getQuery(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Conference.query()
-        inequality_filter, filters = self._formatFilters(request.filters)
+    def _getOrganizerNames(self, conferences):
+        """Return a dict of organizerUserId -> displayName for the
+        conferences saved before they stored their organizer's name.
 
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Conference.name)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Conference.name)
+        conferences must be an already fetched list, so the query behind
+        it is not run again here. Each organiser profile is read once, and
+        none at all once every conference has the name."""
+        # get all keys and use get_multi for speed
+        organisers = set(ndb.Key(Profile, conf.organizerUserId) for conf in conferences
+                         if conf.organizerDisplayName is None)
+        if not organisers:
+            return {}
+        profiles = ndb.get_multi(list(organisers))
 
-        for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+        # put display names in a dict for easier fetching
+        return dict((profile.key.id(), profile.displayName)
+                    for profile in profiles if profile)
+
+
+    def _getQuery(self, request, field=None):
+        """Return a planned query for the submitted filters, together with
+        the filters left to check in memory and the plan. field, if given,
+        is the field whose filters run on the datastore."""
+        filters = self._formatFilters(request.filters)
+        field, pushed, residual, plan = self._planQuery('Conference', filters, field)
+        q = self._buildQuery(Conference, Conference.name, field, pushed)
+        return q, pushed, residual, plan
 
 
     def _formatFilters(self, filters):
-        """Parse, check validity and format user supplied filters."""
+        """Parse, check validity and format user supplied filters.
+        Values are converted to the types stored on Conference."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
 
             try:
+                filtr["input"] = filtr["value"]
                 filtr["field"] = FIELDS[filtr["field"].upper()]
                 filtr["operator"] = OPERATORS[filtr["operator"].upper()]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            try:
+                if filtr["field"] in ["month", "maxAttendees"]:
+                    filtr["value"] = int(filtr["value"])
+            except (TypeError, ValueError):
+                raise endpoints.BadRequestException(
+                    "Invalid value for %s: %s" % (filtr["field"], filtr["value"]))
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
 
 
     @endpoints.method(ConferenceQueryForms, ConferenceForms,
@@ -334,23 +607,69 @@ class ConferenceApi(remote.Service):
             http_method='POST',
             name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
+        """Query for conferences, one page at a time. With view=summary
+        only the fields of ConferenceSummaryForm are read and returned."""
+        view = (request.view or 'full').lower()
+        if view not in ('full', 'summary'):
+            raise endpoints.BadRequestException("view must be 'full' or 'summary'.")
+        limit = request.limit or MAX_PAGE_SIZE
+        if limit < 0:
+            raise endpoints.BadRequestException("limit must be a positive number.")
+        limit = min(limit, MAX_PAGE_SIZE)
+
+        # a pageToken names the field the first page was planned on, so
+        # every page runs the same datastore query as the cursor expects
+        cursor = None
+        field = None
+        if request.pageToken:
+            try:
+                field, token = request.pageToken.split(':', 1)
+                cursor = Cursor(urlsafe=token)
+            except Exception:
+                raise endpoints.BadRequestException("Invalid pageToken.")
+
+        q, pushed, residual, plan = self._getQuery(request, field or None)
+        projection = None
+        if view == 'summary':
+            projection = self._summaryProjection(pushed, residual)
+        # filters not run on the datastore are checked here; keep reading
+        # until the page is full or MAX_SCAN_PER_PAGE conferences were
+        # read, then resume from the last conference read
+        conferences = []
+        more = False
+        it = q.iter(start_cursor=cursor, produce_cursors=True,
+            batch_size=QUERY_BATCH_SIZE if residual else limit,
+            projection=projection)
+        for scanned, conf in enumerate(it, 1):
+            if self._entityMatches(conf, residual):
+                conferences.append(conf)
+            if len(conferences) == limit or scanned == MAX_SCAN_PER_PAGE:
+                more = it.probably_has_next()
+                break
+        next_token = None
+        if more:
+            pushed_fields = [p.field for p in plan if p.pushedDown]
+            next_token = '%s:%s' % (pushed_fields[0] if pushed_fields else '',
+                it.cursor_after().urlsafe())
+
+        if view == 'summary':
+            # properties with an equality filter can't be projected
+            known = dict((f["field"], f["value"]) for f in pushed if f["operator"] == "=")
+            return ConferenceForms(
+                summaries=[self._copyConferenceToSummary(conf, known) for conf in conferences],
+                nextPageToken=next_token,
+                plan=plan if request.explain else []
+            )
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        # organiser displayName is stored on the conferences, except old ones
+        names = self._getOrganizerNames(conferences)
 
         # return individual ConferenceForm object per Conference
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
+                items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId)) for conf in \
+                conferences],
+                nextPageToken=next_token,
+                plan=plan if request.explain else []
         )
 
 
@@ -360,19 +679,30 @@ class ConferenceApi(remote.Service):
         """Copy relevant fields from Profile to ProfileForm."""
         # copy relevant fields from Profile to ProfileForm
         pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
+        for name, convert in PROFILE_FORM_FIELDS:
+            value = getattr(prof, name)
+            if convert:
+                value = convert(value)
+            if value is not None:
+                setattr(pf, name, value)
         return pf
 
 
     def _getProfileFromUser(self):
-        """Return user Profile from datastore, creating new one if non-existent."""
+        """Return user Profile from datastore, creating new one if non-existent.
+
+        endpoints builds a new service instance per request, so the Profile
+        is memoised on self for the rest of the request. Inside a
+        transaction it is always read again, and remembered on commit."""
+        in_transaction = ndb.in_transaction()
+        if not in_transaction and getattr(self, '_profile', None):
+            # a get would mostly be answered by ndb's in-context cache; only
+            # count the reads that cache would have let through
+            if not ndb.get_context().get_cache_policy()(self._profile.key):
+                memcache.Client().incr_async(MEMCACHE_PROFILE_READS_AVOIDED_KEY,
+                    initial_value=0)
+            return self._profile
+
         # make sure user is authed
         user = endpoints.get_current_user()
         if not user:
@@ -392,6 +722,12 @@ class ConferenceApi(remote.Service):
             )
             profile.put()
 
+        if in_transaction:
+            # changes made by the transaction are part of the memo on commit
+            ndb.get_context().call_on_commit(
+                lambda: setattr(self, '_profile', profile))
+        else:
+            self._profile = profile
         return profile      # return Profile
 
 
@@ -402,6 +738,7 @@ class ConferenceApi(remote.Service):
 
         # if saveProfile(), process user-modifyable fields
         if save_request:
+            displayName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -412,11 +749,47 @@ class ConferenceApi(remote.Service):
                         #else:
                         #    setattr(prof, field, val)
             prof.put()
+            if prof.displayName != displayName:
+                # the user's conferences carry a copy of the name
+                taskqueue.add(params={'userId': prof.key.id()},
+                    url='/tasks/update_organizer_name')
 
         # return ProfileForm
         return self._copyProfileToForm(prof)
 
 
+    @staticmethod
+    def _updateOrganizerName(user_id):
+        """Copy an organizer's current displayName onto their conferences."""
+        p_key = ndb.Key(Profile, user_id)
+        cursor = None
+        more = True
+        while more:
+            cursor, more = ConferenceApi._updateOrganizerNamePage(p_key, cursor)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _updateOrganizerNamePage(p_key, cursor):
+        """Update one page of an organizer's conferences. The Profile and
+        its conferences share an entity group, so reading and writing them
+        in one transaction can't undo a concurrent conference update.
+        Returns (cursor, more) for the next page."""
+        prof = p_key.get()
+        if not prof:
+            return None, False
+        confs, cursor, more = Conference.query(ancestor=p_key).fetch_page(
+            QUERY_BATCH_SIZE, start_cursor=cursor)
+        stale = [conf for conf in confs
+                 if conf.organizerDisplayName != prof.displayName]
+        for conf in stale:
+            conf.organizerDisplayName = prof.displayName
+        ndb.put_multi(stale)
+        for conf in stale:
+            ConferenceApi._invalidateConferenceCache(conf.key.urlsafe())
+        return cursor, more
+
+
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
@@ -447,6 +820,10 @@ class ConferenceApi(remote.Service):
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
 
+        # seats live in SeatShards, not on the Conference entity, so
+        # concurrent registrations mostly write different entity groups
+        shards = self._seatShardSnapshot(conf)
+
         # register
         if reg:
             # check if user already registered otherwise add
@@ -455,13 +832,14 @@ class ConferenceApi(remote.Service):
                     "You have already registered for this conference")
 
             # check if seats avail
-            if conf.seatsAvailable <= 0:
+            shard = self._takeSeat(shards)
+            if not shard:
                 raise ConflictException(
                     "There are no seats available.")
 
-            # register user, take away one seat
+            # register user, the seat is already taken away
             prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
+            attendee = self._newAttendee(prof, conf)
             retval = True
 
         # unregister
@@ -471,17 +849,362 @@ class ConferenceApi(remote.Service):
 
                 # unregister user, add back one seat
                 prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
+                shard = self._returnSeat(shards)
+                attendee = None
                 retval = True
             else:
-                retval = False
+                return BooleanMessage(data=False)
 
         # write things back to the datastore & return
-        prof.put()
-        conf.put()
+        if attendee:
+            ndb.put_multi([prof, shard, attendee])
+        else:
+            ndb.put_multi([prof, shard])
+            ndb.Key(Attendee, wsck, parent=prof.key).delete()
+        seats_delta = -1 if reg else 1
+        ndb.get_context().call_on_commit(
+            lambda: self._seatsChanged(conf.key, seats_delta))
+        self._invalidateConferenceCache(wsck)
         return BooleanMessage(data=retval)
 
 
+    @staticmethod
+    def _newAttendee(prof, conf):
+        """Return the unsaved roster entry of a registration. It lives in
+        the Profile's entity group, which the registration writes anyway."""
+        return Attendee(key=ndb.Key(Attendee, conf.key.urlsafe(), parent=prof.key),
+                        conference=conf.key)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _indexProfileAttendees(p_key):
+        """Create the missing roster entries of a Profile's registrations
+        made before the roster existed."""
+        prof = p_key.get()
+        if not prof:
+            return
+        keys = [ndb.Key(Attendee, wsck, parent=p_key)
+                for wsck in prof.conferenceKeysToAttend]
+        missing = [key for key, attendee in zip(keys, ndb.get_multi(keys))
+                   if not attendee]
+        ndb.put_multi([Attendee(key=key, conference=ndb.Key(urlsafe=key.id()))
+                       for key in missing])
+
+
+    @staticmethod
+    def _indexAttendees(urlsafe_cursor=None):
+        """Backfill the roster for one batch of Profiles, then queue the
+        next batch."""
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        p_keys, cursor, more = Profile.query().fetch_page(
+            QUERY_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        for p_key in p_keys:
+            ConferenceApi._indexProfileAttendees(p_key)
+        if more and cursor:
+            taskqueue.add(params={'cursor': cursor.urlsafe()},
+                url='/tasks/index_attendees')
+
+
+    @staticmethod
+    def _seatShardKeys(c_key):
+        """Return the keys of the SeatShards holding a conference's seats."""
+        wsck = c_key.urlsafe()
+        return [ndb.Key(SeatShard, '%s:%d' % (wsck, i)) for i in range(SEAT_SHARDS)]
+
+
+    @staticmethod
+    def _newSeatShards(c_key, seats):
+        """Return unsaved SeatShards splitting seats evenly for a conference."""
+        per_shard, extra = divmod(max(seats or 0, 0), SEAT_SHARDS)
+        return [SeatShard(key=sh_key, seatsAvailable=per_shard + (1 if i < extra else 0))
+                for i, sh_key in enumerate(ConferenceApi._seatShardKeys(c_key))]
+
+
+    @staticmethod
+    @ndb.transactional(xg=True)
+    def _createSeatShards(conf):
+        """Create the SeatShards of a conference that predates seat sharding,
+        seeded from its seatsAvailable; a no-op if they already exist."""
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(conf.key))
+        if None in shards:
+            shards = ConferenceApi._newSeatShards(conf.key, conf.seatsAvailable)
+            ndb.put_multi(shards)
+        return shards
+
+
+    @staticmethod
+    def _resizeSeatShards(conf, delta):
+        """Add delta seats to a conference's SeatShards, spread evenly, or
+        take -delta seats from the fullest shards first. Runs in the
+        caller's transaction, which then holds every shard, so seats taken
+        meanwhile are counted. Raises ConflictException if fewer seats are
+        left than are taken away. Returns the modified, unsaved shards."""
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(conf.key))
+        if None in shards:
+            shards = ConferenceApi._newSeatShards(conf.key, conf.seatsAvailable)
+        if delta > 0:
+            per_shard, extra = divmod(delta, SEAT_SHARDS)
+            for i, shard in enumerate(shards):
+                shard.seatsAvailable += per_shard + (1 if i < extra else 0)
+            return shards
+        if sum(sh.seatsAvailable for sh in shards) < -delta:
+            raise ConflictException(
+                "maxAttendees can't be lower than the number of attendees.")
+        for shard in sorted(shards, key=lambda sh: -sh.seatsAvailable):
+            taken = min(shard.seatsAvailable, -delta)
+            shard.seatsAvailable -= taken
+            delta += taken
+        return shards
+
+
+    @staticmethod
+    @ndb.non_transactional
+    def _seatShardSnapshot(conf):
+        """Return the current SeatShards of a conference, read outside any
+        running transaction so reading them doesn't enlist their groups."""
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(conf.key))
+        if None in shards:
+            shards = ConferenceApi._createSeatShards(conf)
+        return shards
+
+
+    @staticmethod
+    def _takeSeat(shards):
+        """Take one seat from a conference, given a snapshot of its shards.
+
+        The shards that had seats a moment ago are tried in random order.
+        Only the shard re-read here joins the running transaction, which
+        is what makes overselling impossible. Returns the modified, unsaved
+        SeatShard, or None if the conference is sold out."""
+        candidates = [sh.key for sh in shards if sh.seatsAvailable > 0]
+        random.shuffle(candidates)
+        for sh_key in candidates:
+            shard = sh_key.get()
+            if shard.seatsAvailable > 0:
+                shard.seatsAvailable -= 1
+                return shard
+        return None
+
+
+    @staticmethod
+    def _returnSeat(shards):
+        """Give one seat back to a random shard; returns the unsaved shard."""
+        shard = random.choice(shards).key.get()
+        shard.seatsAvailable += 1
+        return shard
+
+
+    @staticmethod
+    def _getSeatsAvailable(conf):
+        """Return the total of a conference's seat shards, cached in memcache."""
+        seats = memcache.get(MEMCACHE_SEATS_KEY % conf.key.urlsafe())
+        if seats is None:
+            seats = ConferenceApi._sumSeatShards(conf.key)
+            if seats is None:
+                # no shards yet, nobody registered since sharding came in
+                return conf.seatsAvailable
+        return seats
+
+
+    @staticmethod
+    def _sumSeatShards(c_key):
+        """Add up a conference's seat shards and cache the total; returns
+        None if the conference has no shards."""
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(c_key))
+        if None in shards:
+            return None
+        seats = sum(sh.seatsAvailable for sh in shards)
+        memcache.add(MEMCACHE_SEATS_KEY % c_key.urlsafe(), seats, time=MEMCACHE_SEATS_TTL)
+        return seats
+
+
+    @staticmethod
+    @ndb.non_transactional
+    def _seatsChanged(c_key, delta):
+        """Apply a committed seat change. This runs from call_on_commit, after
+        the client's change is already durable, so errors are logged rather
+        than raised; the sync task and the hourly reconciliation catch up."""
+        try:
+            ConferenceApi._applySeatsChange(c_key, delta)
+        except Exception:
+            logging.exception('Could not apply seat change for %s', c_key.urlsafe())
+
+
+    @staticmethod
+    def _applySeatsChange(c_key, delta):
+        """Apply a committed seat change to the cached total and schedule
+        copying the total back onto the Conference entity."""
+        cache_key = MEMCACHE_SEATS_KEY % c_key.urlsafe()
+        if delta < 0:
+            seats = memcache.decr(cache_key, -delta)
+        else:
+            seats = memcache.incr(cache_key, delta)
+        if seats is None:
+            seats = ConferenceApi._sumSeatShards(c_key)
+        # only registrations near the sold out end can change the set of
+        # nearly sold out conferences
+        if seats is not None and min(seats, seats - delta) <= LOW_SEATS_THRESHOLD:
+            ConferenceApi._updateLowSeats(c_key, seats)
+
+        # one named task per conference per interval, so a burst of
+        # registrations writes the Conference entity only once
+        try:
+            taskqueue.add(params={'websafeConferenceKey': c_key.urlsafe()},
+                url='/tasks/sync_seats',
+                name='seats-%s-%d' % (c_key.urlsafe(), int(time.time() / SEATS_SYNC_INTERVAL)),
+                countdown=SEATS_SYNC_INTERVAL)
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+
+
+    @staticmethod
+    def _syncSeatsAvailable(websafeConferenceKey):
+        """Copy the sum of a conference's seat shards to
+        Conference.seatsAvailable, which queries and list views read."""
+        c_key = ndb.Key(urlsafe=websafeConferenceKey)
+        shards = ndb.get_multi(ConferenceApi._seatShardKeys(c_key))
+        if None in shards:
+            return
+        seats = sum(sh.seatsAvailable for sh in shards)
+        memcache.set(MEMCACHE_SEATS_KEY % websafeConferenceKey, seats,
+            time=MEMCACHE_SEATS_TTL)
+
+        @ndb.transactional()
+        def _update():
+            conf = c_key.get()
+            if conf and conf.seatsAvailable != seats:
+                conf.seatsAvailable = seats
+                conf.put()
+                ConferenceApi._invalidateConferenceCache(websafeConferenceKey)
+        _update()
+
+
+    @staticmethod
+    @ndb.non_transactional
+    def _getConferencesByKey(wscks):
+        """Return a dict of websafeConferenceKey -> Conference (or None),
+        read outside any running transaction."""
+        keys = {}
+        for wsck in set(wscks):
+            try:
+                keys[wsck] = ndb.Key(urlsafe=wsck)
+            except Exception:
+                keys[wsck] = None
+        valid = [wsck for wsck in keys if keys[wsck] and keys[wsck].kind() == 'Conference']
+        confs = dict.fromkeys(keys)
+        confs.update(zip(valid, ndb.get_multi([keys[wsck] for wsck in valid])))
+        return confs
+
+
+    @ndb.transactional(xg=True)
+    def _conferenceRegistrationBatch(self, wscks):
+        """Register user for several conferences in one transaction.
+
+        The Profile and each conference's seat shard are written once, with
+        a single put_multi. A conference that can't be booked gets an error
+        in its result instead of aborting the others."""
+        prof = self._getProfileFromUser() # get user Profile
+        confs = self._getConferencesByKey(wscks)
+
+        results = []
+        shards = []
+        attendees = []
+        attending = set(prof.conferenceKeysToAttend)
+        for wsck in wscks:
+            result = RegistrationResultForm(websafeConferenceKey=wsck, data=False)
+            results.append(result)
+            conf = confs[wsck]
+            if not conf:
+                result.error = 'No conference found with key: %s' % wsck
+                continue
+            if wsck in attending:
+                result.error = "You have already registered for this conference"
+                continue
+            shard = self._takeSeat(self._seatShardSnapshot(conf))
+            if not shard:
+                result.error = "There are no seats available."
+                continue
+            prof.conferenceKeysToAttend.append(wsck)
+            attending.add(wsck)
+            shards.append(shard)
+            attendees.append(self._newAttendee(prof, conf))
+            result.data = True
+
+        # write things back to the datastore & return
+        if shards:
+            ndb.put_multi([prof] + shards + attendees)
+            booked = [confs[r.websafeConferenceKey].key for r in results if r.data]
+            def _booked():
+                for c_key in booked:
+                    self._seatsChanged(c_key, -1)
+            ndb.get_context().call_on_commit(_booked)
+            for c_key in booked:
+                self._invalidateConferenceCache(c_key.urlsafe())
+        return results
+
+
+    @endpoints.method(RegistrationRequestForm, RegistrationResultForms,
+            path='conferences/register',
+            http_method='POST', name='registerForConferencesBatch')
+    def registerForConferencesBatch(self, request):
+        """Register user for several conferences, one result per conference."""
+        wscks = request.websafeConferenceKeys
+        results = []
+        # keep each transaction well inside the 25 entity group XG limit
+        for i in range(0, len(wscks), MAX_BATCH_REGISTRATIONS):
+            results.extend(self._conferenceRegistrationBatch(
+                wscks[i:i + MAX_BATCH_REGISTRATIONS]))
+        return RegistrationResultForms(items=results)
+
+
+    @endpoints.method(ATTENDEES_GET_REQUEST, AttendeeForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return a page of the users registered for a conference (organizer
+        only), oldest registration first."""
+        user = endpoints.get_current_user()
+        if not user:
+            raise endpoints.UnauthorizedException('Authorization required')
+        user_id = getUserId(user)
+
+        wsck = request.websafeConferenceKey
+        conf = ndb.Key(urlsafe=wsck).get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the organizer can see the attendees.')
+
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = Cursor(urlsafe=request.pageToken)
+            except Exception:
+                raise endpoints.BadRequestException("Invalid pageToken.")
+        limit = min(request.limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+
+        attendees, cursor, more = Attendee.query(
+            Attendee.conference == conf.key).order(
+            Attendee.registered, Attendee.key).fetch_page(
+            limit, start_cursor=cursor)
+        profiles = ndb.get_multi([a.key.parent() for a in attendees])
+
+        items = []
+        for attendee, prof in zip(attendees, profiles):
+            if not prof:
+                continue
+            form = AttendeeForm(displayName=prof.displayName,
+                mainEmail=prof.mainEmail, registered=str(attendee.registered))
+            if prof.teeShirtSize:
+                form.teeShirtSize = getattr(TeeShirtSize, prof.teeShirtSize)
+            items.append(form)
+        return AttendeeForms(items=items,
+            nextPageToken=cursor.urlsafe() if more and cursor else None)
+
+
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
@@ -492,16 +1215,10 @@ class ConferenceApi(remote.Service):
         conferences = ndb.get_multi(conf_keys)
 
         # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        names = self._getOrganizerNames(conferences)
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
+        return ConferenceForms(items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId))\
          for conf in conferences]
         )
 
@@ -526,44 +1243,148 @@ class ConferenceApi(remote.Service):
 
     @staticmethod
     def _cacheAnnouncement():
-        """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
+        """Reconcile the nearly sold out set with the datastore, then
+        create Announcement & assign to memcache; used by memcache cron job.
+        Registrations keep the set current in between (_updateLowSeats).
         """
         confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
+            Conference.seatsAvailable <= LOW_SEATS_THRESHOLD,
             Conference.seatsAvailable > 0)
         ).fetch(projection=[Conference.name])
 
-        if confs:
+        @ndb.transactional()
+        def _reconcile():
+            low = LowSeatsIndex(key=ndb.Key(LowSeatsIndex, LOW_SEATS_INDEX_ID),
+                conferences=dict((conf.key.urlsafe(), conf.name) for conf in confs))
+            low.put()
+            return low
+        return ConferenceApi._setAnnouncement(_reconcile())
+
+
+    @staticmethod
+    def _updateLowSeats(c_key, seats):
+        """Add a conference to or drop it from the nearly sold out set as
+        its total seats cross the 1 to LOW_SEATS_THRESHOLD band, and
+        regenerate the announcement straight away if the set changed."""
+        wsck = c_key.urlsafe()
+        in_band = 0 < seats <= LOW_SEATS_THRESHOLD
+
+        @ndb.transactional(xg=True)
+        def _update():
+            key = ndb.Key(LowSeatsIndex, LOW_SEATS_INDEX_ID)
+            low = key.get() or LowSeatsIndex(key=key, conferences={})
+            if in_band == (wsck in low.conferences):
+                return None
+            if in_band:
+                low.conferences[wsck] = c_key.get().name
+            else:
+                del low.conferences[wsck]
+            low.put()
+            return low
+
+        try:
+            low = _update()
+        except datastore_errors.TransactionFailedError:
+            # the hourly reconciliation in _cacheAnnouncement catches up
+            logging.warning('Could not update nearly sold out set for %s', wsck)
+            return
+        if low:
+            ConferenceApi._setAnnouncement(low)
+
+
+    @staticmethod
+    def _setAnnouncement(low):
+        """Format the announcement for a LowSeatsIndex & assign to memcache."""
+        if low.conferences:
             # If there are almost sold out conferences,
             # format announcement and set it in memcache
             announcement = '%s %s' % (
                 'Last chance to attend! The following conferences '
                 'are nearly sold out:',
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+                ', '.join(sorted(low.conferences.values())))
         else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
+            # If there are no sold out conferences, store an empty
+            # announcement so readers can tell it from an evicted one
             announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        ConferenceApi._storeAnnouncement(MEMCACHE_ANNOUNCEMENTS_KEY,
+            announcement, '/crons/set_announcement')
 
         return announcement
 
+
+    @staticmethod
+    def _storeAnnouncement(cache_key, announcement, url, params=None):
+        """Assign an announcement to memcache and save it as the snapshot
+        served while memcache doesn't have it. url and params describe the
+        task that recomputes it."""
+        memcache.set(cache_key, announcement)
+        AnnouncementSnapshot(id=cache_key, data=announcement,
+            url=url, params=params or {}).put()
+
+
+    @staticmethod
+    def _readAnnouncement(cache_key, url):
+        """Return an announcement from memcache or, if memcache lost it,
+        from its snapshot; None if it was never stored.
+
+        On a miss the snapshot goes back into memcache, so other callers
+        don't miss too, and one named task per key and interval recomputes
+        the announcement in the background: the snapshot's task, or a
+        plain POST to url if there is no snapshot yet."""
+        announcement = memcache.get(cache_key)
+        if announcement is not None:
+            return announcement
+        snapshot = ndb.Key(AnnouncementSnapshot, cache_key).get()
+        params = {}
+        if snapshot:
+            memcache.add(cache_key, snapshot.data)
+            url, params = snapshot.url, snapshot.params
+        try:
+            taskqueue.add(url=url, params=params,
+                name='refresh-%s-%d' % (
+                    re.sub('[^a-zA-Z0-9_-]', '-', cache_key),
+                    int(time.time() / ANNOUNCEMENT_REFRESH_INTERVAL)))
+        except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+            pass
+        return snapshot.data if snapshot else None
+
     @staticmethod
     def _featuredSpeaker(speaker, websafeConferenceKey):
-        """finds out featuredspeaker & assign to memcache"""
-        conf = ndb.Key(urlsafe=websafeConferenceKey).get()
-        conf_key = conf.key
-
-        sessions = Session.query(ancestor=conf_key)
-        sessions = sessions.filter(Session.speaker == speaker)
-        if sessions.count()>1:
-            sessions_name = ', '.join([session.name for session in sessions])
-            announcement =  "our featured speaker is %s and he is speaking at %s" % (speaker, sessions_name)
+        """finds out featuredspeaker from the conference's speaker index &
+        assign to memcache, for the conference and as the latest overall;
+        without a speaker, features whoever gives the most sessions, and
+        without a conference, whoever gives the most at any conference"""
+        conf_key = ndb.Key(urlsafe=websafeConferenceKey) if websafeConferenceKey else None
+        if speaker and conf_key:
+            idx = ndb.Key(SpeakerSessions, ConferenceApi._speakerId(speaker),
+                parent=conf_key).get()
         else:
-            announcement = ""
-        memcache.set(MEMCACHE_FEATURED_SPEAKER_KEY, announcement)
+            idx = SpeakerSessions.query(ancestor=conf_key).order(
+                -SpeakerSessions.sessionCount).get()
+        announcement = ConferenceApi._featuredSpeakerAnnouncement(idx)
+        if announcement:
+            websafeConferenceKey = idx.key.parent().urlsafe()
+            params = {'speaker': idx.speaker,
+                      'websafeConferenceKey': websafeConferenceKey}
+            memcache.set(MEMCACHE_CONF_FEATURED_SPEAKER_KEY % websafeConferenceKey,
+                announcement)
+            ConferenceApi._storeAnnouncement(MEMCACHE_FEATURED_SPEAKER_KEY,
+                announcement, '/tasks/setFeaturedSpeaker', params)
+        elif not conf_key:
+            # nobody to feature anywhere; store that, so readers stop asking
+            ConferenceApi._storeAnnouncement(MEMCACHE_FEATURED_SPEAKER_KEY,
+                announcement, '/tasks/setFeaturedSpeaker')
+        return announcement
+
+
+    @staticmethod
+    def _featuredSpeakerAnnouncement(idx):
+        """Format the announcement for a SpeakerSessions entry, or return ""
+        if the speaker gives fewer than two sessions."""
+        if not idx or idx.sessionCount < 2:
+            return ""
+        return "our featured speaker is %s and he is speaking at %s" % (
+            idx.speaker, ', '.join(idx.sessionNames))
 
 
 
@@ -571,24 +1392,34 @@ class ConferenceApi(remote.Service):
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
-        """Return Announcement from memcache."""
-        # TODO 1
-        # return an existing announcement from Memcache or an empty string.
-        announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
-        if not announcement:
-            announcement = ""
-        return StringMessage(data=announcement)
+        """Return Announcement from memcache, or its last snapshot."""
+        announcement = self._readAnnouncement(MEMCACHE_ANNOUNCEMENTS_KEY,
+            '/crons/set_announcement')
+        return StringMessage(data=announcement or "")
 
     @endpoints.method(message_types.VoidMessage, FeaturedSpeakerMessage,
             path='conference/announcement/featuredspeakder/get',
             http_method='GET', name='getFeaturedSpeaker')
     def getFeaturedSpeaker(self, request):
-        """Return Announcement from memcache."""
-        # TODO 1
-        # return an existing announcement from Memcache or an empty string.
-        announcement = memcache.get(MEMCACHE_FEATURED_SPEAKER_KEY)
-        if not announcement:
-            announcement = ""
+        """Return the latest featured speaker from memcache, or its last
+        snapshot."""
+        announcement = self._readAnnouncement(MEMCACHE_FEATURED_SPEAKER_KEY,
+            '/tasks/setFeaturedSpeaker')
+        return FeaturedSpeakerMessage(data=announcement or "")
+
+    @endpoints.method(CONF_GET_REQUEST, FeaturedSpeakerMessage,
+            path='conference/{websafeConferenceKey}/featuredspeaker',
+            http_method='GET', name='getConferenceFeaturedSpeaker')
+    def getConferenceFeaturedSpeaker(self, request):
+        """Return the featured speaker of a conference."""
+        wsck = request.websafeConferenceKey
+        announcement = memcache.get(MEMCACHE_CONF_FEATURED_SPEAKER_KEY % wsck)
+        if announcement is None:
+            # not cached: feature whoever gives the most sessions
+            idx = SpeakerSessions.query(ancestor=ndb.Key(urlsafe=wsck)).order(
+                -SpeakerSessions.sessionCount).get()
+            announcement = self._featuredSpeakerAnnouncement(idx)
+            memcache.set(MEMCACHE_CONF_FEATURED_SPEAKER_KEY % wsck, announcement)
         return FeaturedSpeakerMessage(data=announcement)
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - -
@@ -596,15 +1427,13 @@ class ConferenceApi(remote.Service):
     def _copySessionToForm(self, session):
         """ This method copies values of a session object to SessionForm messages """
         sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                if field.name =="startTime" or field.name == "date":
-                    setattr(sf,field.name,str(getattr(session, field.name)))
-                else :
-                    setattr(sf, field.name, getattr(session, field.name))    
-            elif field.name == 'websafeSessionKey':
-                setattr(sf, field.name, session.key.urlsafe())            
-        #sf.check_initialized()
+        for name, convert in SESSION_FORM_FIELDS:
+            value = getattr(session, name)
+            if convert:
+                value = convert(value)
+            if value is not None:
+                setattr(sf, name, value)
+        sf.websafeSessionKey = session.key.urlsafe()
         return sf
 
     def _getConferenceSessions(self, request, typeOfSession=None, speaker=None):
@@ -629,7 +1458,17 @@ class ConferenceApi(remote.Service):
             # filter type of session if provided
             if typeOfSession is not None:
                 sessions = sessions.filter(Session.typeOfSession == typeOfSession)
-        else: # if conf key is none then filter by speaker only
+        elif self._speakerId(speaker or ''):
+            # if conf key is none then filter by speaker only, under any
+            # spelling of the name; sessions /tasks/index_speakers hasn't
+            # linked yet only match the name as written
+            sessions = list(self._speakerSessionsQuery(speaker))
+            unlinked = [s for s in Session.query(Session.speaker == speaker)
+                        if not s.speakerKey]
+            if unlinked:
+                sessions = sorted(sessions + unlinked,
+                                  key=lambda s: (s.date, s.startTime))
+        else:
             sessions = Session.query(Session.speaker == speaker)
         return SessionForms(
             sessions = [self._copySessionToForm(session)for session in sessions])
@@ -638,12 +1477,28 @@ class ConferenceApi(remote.Service):
     def _createSession(self,request):
         """CreateSession - to create session when provided with websafeConferenceKey
         along with other property, Name property is required """
+        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
+        if not data['name'] or data['name'].strip()=="":
+            raise endpoints.BadRequestException("you must provide name for the session.")
+        self._sessionEntityData(data)
+
+        wsck = request.websafeConferenceKey
+        del data['websafeSessionKey']
+        del data['websafeConferenceKey']
+
+        # the conference get and the ID allocation don't depend on the
+        # profile: start both and read the profile while they run
+        conf_key = ndb.Key(urlsafe=wsck)
+        conf_future = conf_key.get_async()
+        ids_future = Session.allocate_ids_async(size=1, parent=conf_key)
+        speaker_key = None
+        if self._speakerId(data['speaker'] or ''):
+            speaker_key = ndb.Key(Speaker, self._speakerId(data['speaker']))
+            speaker_future = speaker_key.get_async()
         prof = self._getProfileFromUser()
         user_id = prof.mainEmail
 
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
-        conf_key = conf.key
+        conf = conf_future.get_result()
         if not conf:
             raise endpoints.NotFoundException('Conference key is invalid')
 
@@ -651,30 +1506,164 @@ class ConferenceApi(remote.Service):
             raise endpoints.UnauthorizedException(
                 'you are not the %s'% conf.organizerUserId)
 
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        if not data['name'] or data['name'].strip()=="":
-            raise endpoints.BadRequestException("you must provide name for the session.")
+        s_id = ids_future.get_result()[0]
+        data['key'] = ndb.Key(Session, s_id, parent=conf_key)
+        if speaker_key and not speaker_future.get_result():
+            Speaker(key=speaker_key, name=data['speaker']).put()
+        data['speakerKey'] = speaker_key
+
+        # the entity holds everything that was saved, no need to get it back
+        session = Session(**data)
+        self._putSession(session)
+
+        return session
+
+
+    @staticmethod
+    def _speakerId(name):
+        """Return the normalised speaker name that keys Speaker: its lower
+        case words, so case, spacing and punctuation don't matter."""
+        return ' '.join(re.findall(r'\w+', name.lower(), re.UNICODE))
+
+
+    @staticmethod
+    def _resolveSpeakers(names):
+        """Return {name: Speaker key} for speaker names, creating the
+        Speakers that don't exist yet. Names without words are left out."""
+        keys = {}
+        for name in set(names):
+            if name and ConferenceApi._speakerId(name):
+                keys[name] = ndb.Key(Speaker, ConferenceApi._speakerId(name))
+        new = dict((key, name) for name, key in keys.items())
+        for speaker in ndb.get_multi(list(new)):
+            if speaker:
+                del new[speaker.key]
+        ndb.put_multi([Speaker(key=key, name=name) for key, name in new.items()])
+        return keys
+
+
+    @staticmethod
+    def _speakerSessionsQuery(speaker):
+        """Return the query for the sessions of a speaker, in date order."""
+        speaker_key = ndb.Key(Speaker, ConferenceApi._speakerId(speaker))
+        return Session.query(Session.speakerKey == speaker_key).order(
+            Session.date, Session.startTime, Session.key)
+
+
+    @staticmethod
+    def _indexSpeakers(urlsafe_cursor=None):
+        """Link one batch of sessions saved before Speaker existed to their
+        speakers, then queue the next batch."""
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        sessions, cursor, more = Session.query().fetch_page(
+            QUERY_BATCH_SIZE, start_cursor=cursor)
+        sessions = [s for s in sessions if s.speaker and not s.speakerKey]
+        speaker_keys = ConferenceApi._resolveSpeakers(s.speaker for s in sessions)
+        for session in sessions:
+            session.speakerKey = speaker_keys.get(session.speaker)
+        ndb.put_multi([s for s in sessions if s.speakerKey])
+        if more and cursor:
+            taskqueue.add(params={'cursor': cursor.urlsafe()},
+                url='/tasks/index_speakers')
+
+
+    @staticmethod
+    def _sessionEntityData(data):
+        """Turn new session data into Session property values."""
         if data['startTime']:
             data['startTime']=datetime.strptime("1970-01-01 "+data['startTime'][:8],"%Y-%m-%d %H:%M")
         if data['date']:
             data['date'] = datetime.strptime(data['date'][:10],"%Y-%m-%d").date()
-        
-        del data['websafeSessionKey']
-        del data['websafeConferenceKey']
+        return data
 
-        s_id = Session.allocate_ids(size=1, parent=conf_key )[0]
-        s_key = ndb.Key(Session, s_id, parent = conf_key)
-        data['key']=s_key
-        
-        Session(**data).put()
-        session = s_key.get()
 
-        taskqueue.add(params={'speaker': data['speaker'],
-            'websafeConferenceKey': wsck},
-            url='/tasks/setFeaturedSpeaker'
-        )
+    @staticmethod
+    def _putSession(session):
+        """Save a new session and count it in its conference's speaker index,
+        both in the conference's entity group."""
+        ConferenceApi._putSessions([session])
 
-        return session
+
+    @staticmethod
+    @ndb.transactional()
+    def _putSessions(sessions):
+        """Save new sessions of one conference with their search terms,
+        count them in its speaker index and place them on its schedule
+        timeline, all in the conference's entity group."""
+        timeline = ConferenceApi._timelineWith(sessions)
+        ndb.put_multi(sessions +
+            [ConferenceApi._searchDocument(session) for session in sessions] +
+            ([timeline] if timeline else []))
+        if ConferenceApi._indexSpeakerSessions(sessions):
+            ConferenceApi._scheduleFeaturedSpeaker(sessions[0].key.parent())
+        ConferenceApi._recordFieldStats('Session',
+            added=[ConferenceApi._fieldValues(session, SESSIONFIELDS.values())
+                   for session in sessions])
+
+
+    @staticmethod
+    def _indexSpeakerSessions(sessions):
+        """Add new sessions of one conference to the SpeakerSessions entries
+        of their speakers, keyed like Speaker so that spelling variants of
+        a name share one entry; returns whether any session had a speaker."""
+        by_speaker = {}
+        for session in sessions:
+            speaker_id = ConferenceApi._speakerId(session.speaker or '')
+            if speaker_id:
+                by_speaker.setdefault(speaker_id, []).append(session)
+        if not by_speaker:
+            return False
+        conf_key = sessions[0].key.parent()
+        new_keys = set(session.key for session in sessions)
+        speaker_ids = list(by_speaker)
+        entries = ndb.get_multi(
+            [ndb.Key(SpeakerSessions, speaker_id, parent=conf_key)
+             for speaker_id in speaker_ids])
+        legacy = []
+        for i, speaker_id in enumerate(speaker_ids):
+            idx = entries[i]
+            names = set(s.speaker for s in by_speaker[speaker_id])
+            if not idx:
+                # first indexed session of this speaker here: pick up sessions
+                # saved before the index existed (this runs once per speaker),
+                # linked to the Speaker or not yet, and drop the entries once
+                # keyed by the raw name
+                earlier = Session.query(
+                    Session.speakerKey == ndb.Key(Speaker, speaker_id),
+                    ancestor=conf_key).fetch()
+                earlier += Session.query(Session.speaker.IN(list(names)),
+                    ancestor=conf_key).fetch()
+                earlier = dict((s.key, s) for s in earlier
+                               if s.key not in new_keys).values()
+                idx = SpeakerSessions(
+                    key=ndb.Key(SpeakerSessions, speaker_id, parent=conf_key),
+                    speaker=by_speaker[speaker_id][0].speaker,
+                    sessionNames=[s.name for s in earlier])
+                legacy.extend(ndb.Key(SpeakerSessions, name, parent=conf_key)
+                              for name in names if name != speaker_id)
+            idx.sessionNames.extend(s.name for s in by_speaker[speaker_id])
+            entries[i] = idx
+        ndb.put_multi(entries)
+        ndb.delete_multi(legacy)
+        return True
+
+
+    @staticmethod
+    def _scheduleFeaturedSpeaker(conf_key):
+        """Once the running transaction commits, recompute the featured
+        speaker of a conference at the end of the current interval. The
+        task is named after the interval, so all sessions added to the
+        conference meanwhile share it."""
+        wsck = conf_key.urlsafe()
+        def _schedule():
+            try:
+                taskqueue.add(params={'websafeConferenceKey': wsck},
+                    url='/tasks/setFeaturedSpeaker',
+                    name='speaker-%s-%d' % (wsck, int(time.time() / FEATURED_SPEAKER_INTERVAL)),
+                    countdown=FEATURED_SPEAKER_INTERVAL)
+            except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+                pass
+        ndb.get_context().call_on_commit(_schedule)
 
 
     @endpoints.method(SESSION_GET_REQUEST, SessionForms,
@@ -701,6 +1690,32 @@ class ConferenceApi(remote.Service):
         """ Return all sessions from a conference with particular type """
         return self._getConferenceSessions(request, speaker=request.speaker)
 
+    @endpoints.method(SPEAKER_GET_REQUEST, SessionForms,
+            path='sessions/speaker',
+            http_method='GET', name='getSessionsBySpeaker')
+    def getSessionsBySpeaker(self, request):
+        """Return a page of a speaker's sessions across all conferences, in
+        date order; any spelling of the name with the same words matches."""
+        if not self._speakerId(request.speaker or ''):
+            raise endpoints.BadRequestException("speaker is required.")
+        limit = request.limit or MAX_PAGE_SIZE
+        if limit < 0:
+            raise endpoints.BadRequestException("limit must be a positive number.")
+        limit = min(limit, MAX_PAGE_SIZE)
+        cursor = None
+        if request.pageToken:
+            try:
+                cursor = Cursor(urlsafe=request.pageToken)
+            except Exception:
+                raise endpoints.BadRequestException("Invalid pageToken.")
+
+        sessions, cursor, more = self._speakerSessionsQuery(
+            request.speaker).fetch_page(limit, start_cursor=cursor)
+        return SessionForms(
+            sessions=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=cursor.urlsafe() if more and cursor else None
+        )
+
     @endpoints.method(SESSION_POST_REQUEST, SessionForm,
             path = 'conference/session/create/{websafeConferenceKey}',
             http_method='POST', name='createSession')
@@ -712,43 +1727,275 @@ class ConferenceApi(remote.Service):
 
        
 
+# - - - Schedule - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _scheduleMinute(when):
+        """Return a datetime as minutes since SCHEDULE_EPOCH."""
+        return int((when - SCHEDULE_EPOCH).total_seconds()) // 60
+
+
+    @staticmethod
+    def _sessionInterval(session):
+        """Return [start, end] of a session in minutes since SCHEDULE_EPOCH,
+        or None if it has no date, start time or duration."""
+        if not (session.date and session.startTime and (session.duration or 0) > 0):
+            return None
+        start = ConferenceApi._scheduleMinute(
+            datetime.combine(session.date, session.startTime.time()))
+        return [start, start + session.duration]
+
+
+    @staticmethod
+    def _buildTimeline(timeline, intervals):
+        """Store intervals ([start, end, session id]) on a ScheduleTimeline
+        sorted by start, with the max end of every search tree node."""
+        intervals = sorted(intervals)
+        max_end = [0] * len(intervals)
+        def fill(lo, hi):
+            if lo >= hi:
+                return 0
+            mid = (lo + hi) // 2
+            max_end[mid] = max(intervals[mid][1], fill(lo, mid), fill(mid + 1, hi))
+            return max_end[mid]
+        fill(0, len(intervals))
+        timeline.intervals = intervals
+        timeline.maxEnd = max_end
+        return timeline
+
+
+    @staticmethod
+    def _newTimeline(conf_key, exclude=()):
+        """Return an unsaved ScheduleTimeline of the sessions a conference
+        has, apart from those keyed in exclude."""
+        intervals = []
+        for session in Session.query(ancestor=conf_key):
+            interval = ConferenceApi._sessionInterval(session)
+            if interval and session.key not in exclude:
+                intervals.append(interval + [session.key.id()])
+        return ConferenceApi._buildTimeline(ScheduleTimeline(
+            key=ndb.Key(ScheduleTimeline, 'timeline', parent=conf_key)), intervals)
+
+
+    @staticmethod
+    def _timelineWith(sessions):
+        """Return the unsaved ScheduleTimeline of a conference with its new
+        sessions added, or None if none of them is scheduled."""
+        intervals = []
+        for session in sessions:
+            interval = ConferenceApi._sessionInterval(session)
+            if interval:
+                intervals.append(interval + [session.key.id()])
+        if not intervals:
+            return None
+        conf_key = sessions[0].key.parent()
+        timeline = ndb.Key(ScheduleTimeline, 'timeline', parent=conf_key).get()
+        if not timeline:
+            # first scheduled session here: pick up sessions saved before
+            # the timeline existed (this runs once per conference)
+            timeline = ConferenceApi._newTimeline(conf_key,
+                exclude=set(session.key for session in sessions))
+        return ConferenceApi._buildTimeline(timeline,
+            timeline.intervals + intervals)
+
+
+    @staticmethod
+    def _getTimelines(conf_keys):
+        """Return {conference key: ScheduleTimeline} for the conferences
+        that exist. A conference whose sessions predate timelines gets one
+        built in memory, by a query over its sessions, until
+        /tasks/index_timelines saves it; reads never save it."""
+        conf_keys = list(set(conf_keys))
+        conf_futures = ndb.get_multi_async(conf_keys)
+        timelines = ndb.get_multi(
+            [ndb.Key(ScheduleTimeline, 'timeline', parent=c_key) for c_key in conf_keys])
+        found = {}
+        for c_key, conf, timeline in zip(conf_keys, conf_futures, timelines):
+            if conf.get_result():
+                found[c_key] = timeline or ConferenceApi._newTimeline(c_key)
+        return found
+
+
+    @staticmethod
+    def _indexTimelines(urlsafe_cursor=None):
+        """Save a ScheduleTimeline for each conference in one batch whose
+        sessions predate timelines, then queue the next batch."""
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        conf_keys, cursor, more = Conference.query().fetch_page(
+            QUERY_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        timelines = ndb.get_multi(
+            [ndb.Key(ScheduleTimeline, 'timeline', parent=c_key) for c_key in conf_keys])
+
+        @ndb.transactional()
+        def _save(c_key):
+            # a session added since the batch was read may have saved one
+            if not ndb.Key(ScheduleTimeline, 'timeline', parent=c_key).get():
+                ConferenceApi._newTimeline(c_key).put()
+
+        for c_key, timeline in zip(conf_keys, timelines):
+            if not timeline:
+                _save(c_key)
+        if more and cursor:
+            taskqueue.add(params={'cursor': cursor.urlsafe()},
+                url='/tasks/index_timelines')
+
+
+    @staticmethod
+    def _timelineSearch(timeline, start, end):
+        """Return the ids of the sessions overlapping minutes [start, end),
+        in start order. Subtrees whose max end is not after start, and the
+        right subtree of a node starting at or after end, are skipped, so
+        the search visits O(log n) nodes per session found, O(k log n) for
+        k sessions. The caller has already decoded the whole timeline, which
+        is O(n) per read; the walk only saves comparing every interval."""
+        intervals, max_end = timeline.intervals, timeline.maxEnd
+        found = []
+        ranges = [(0, len(intervals))]
+        while ranges:
+            lo, hi = ranges.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if max_end[mid] <= start:
+                continue
+            ranges.append((lo, mid))
+            if intervals[mid][0] < end:
+                if intervals[mid][1] > start:
+                    found.append(mid)
+                ranges.append((mid + 1, hi))
+        return [intervals[i][2] for i in sorted(found)]
+
+
+    def _scheduleConflicts(self, s_keys, wish_keys):
+        """Return a ScheduleConflictForm for each session in s_keys that
+        overlaps other sessions in wish_keys. Only sessions of the same
+        conference are compared, through the conference's timeline."""
+        wished = set(wish_keys)
+        s_keys = [key for key in s_keys if key.kind() == 'Session']
+        sessions = ndb.get_multi(s_keys)
+        timelines = self._getTimelines(key.parent() for key in s_keys)
+        conflicts = []
+        for key, session in zip(s_keys, sessions):
+            timeline = timelines.get(key.parent())
+            interval = session and self._sessionInterval(session)
+            if not (timeline and interval):
+                continue
+            clashes = [ndb.Key(Session, s_id, parent=key.parent())
+                       for s_id in self._timelineSearch(timeline, *interval)]
+            clashes = [k.urlsafe() for k in clashes if k in wished and k != key]
+            if clashes:
+                conflicts.append(ScheduleConflictForm(
+                    websafeSessionKey=key.urlsafe(),
+                    conflictingSessionKeys=clashes))
+        return conflicts
+
+
+    @endpoints.method(SESSIONS_AT_REQUEST, SessionForms,
+            path='conference/{websafeConferenceKey}/sessions/at',
+            http_method='GET', name='getSessionsAt')
+    def getSessionsAt(self, request):
+        """Return the sessions of a conference running at time, given as
+        YYYY-MM-DD HH:MM."""
+        try:
+            at = datetime.strptime(request.time[:16].replace('T', ' '),
+                '%Y-%m-%d %H:%M')
+        except (TypeError, ValueError):
+            raise endpoints.BadRequestException("time must be YYYY-MM-DD HH:MM.")
+        conf_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        timeline = None
+        if conf_key.kind() == 'Conference':
+            timeline = self._getTimelines([conf_key]).get(conf_key)
+        if not timeline:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        minute = self._scheduleMinute(at)
+        sessions = ndb.get_multi([ndb.Key(Session, s_id, parent=conf_key)
+            for s_id in self._timelineSearch(timeline, minute, minute + 1)])
+        return SessionForms(
+            sessions=[self._copySessionToForm(session) for session in sessions if session])
+
+
+    @endpoints.method(WishListRequestForm, ScheduleConflictForms,
+            path='conference/session/wishlist/conflicts',
+            http_method='POST', name='getScheduleConflicts')
+    def getScheduleConflicts(self, request):
+        """Return the sessions of the user's WishList that clash with the
+        given sessions, or with each other if none are given."""
+        prof = self._getProfileFromUser()
+        wish = self._getWishList(prof)
+        wish_keys = wish.sessionKeys if wish else []
+        if request.sessionKeys:
+            s_keys = [ndb.Key(urlsafe=wssk) for wssk in request.sessionKeys]
+        else:
+            s_keys = wish_keys
+        return ScheduleConflictForms(items=self._scheduleConflicts(s_keys, wish_keys))
+
+
 # - - - WishList - - - - - - - - - - - - - - - - - - - - - - - -
 
+    @staticmethod
+    def _wishListKey(prof):
+        """Return the key of a user's WishList, derived from their Profile."""
+        return ndb.Key(WishList, prof.key.id())
+
+
+    def _getWishList(self, prof):
+        """Return the user's WishList, or None if they don't have one yet."""
+        wish = self._wishListKey(prof).get()
+        if not wish:
+            # wishlists saved before they were keyed by profile have an
+            # auto id; move such a wishlist to its derived key once
+            legacy = WishList.query(WishList.mainEmail == prof.mainEmail).get()
+            if legacy:
+                wish = WishList(key=self._wishListKey(prof),
+                    mainEmail=legacy.mainEmail, sessionKeys=legacy.sessionKeys)
+                wish.put()
+                legacy.key.delete()
+        return wish
+
+
     def _handleWishList(self, request, rem=False):
         """ add and delete sessions from wish list in datastore"""
         prof = self._getProfileFromUser()
         mainEmail = prof.mainEmail
 
-        wishes = WishList.query()
-        wishes = wishes.filter(WishList.mainEmail == mainEmail)
-        wish = wishes.get()
-        
+        wish = self._getWishList(prof)
+        if not wish: # user adding sessions to wishlist for the first time
+            wish = WishList(key = self._wishListKey(prof), mainEmail= mainEmail)
+
+        # a set of the keys already in the wishlist makes each check O(1),
+        # so the whole request is linear in the wishlist plus request size
+        present = set(wish.sessionKeys)
+        requested = [ndb.Key(urlsafe=s_key) for s_key in request.sessionKeys]
+
         # check if its a request for removing the session from wishlist
         if rem:
-            for s_key in request.sessionKeys:
-                if ndb.Key(urlsafe=s_key) not in wish.sessionKeys:
+            for s_key, key in zip(request.sessionKeys, requested):
+                if key not in present:
                     # request to remove sessions that does not exist
                     raise ConflictException("session %s not present in your wish list"% s_key)
-                else :                    
-                    wish.sessionKeys.remove(ndb.Key(urlsafe=s_key))
-        else :            
-            if not wish: # request to add a new seesion for user adding firsttime in wishlist
-                wish = WishList(
-                    mainEmail= mainEmail,
-                    sessionKeys= [ndb.Key(urlsafe=s_key) for s_key in request.sessionKeys],)
-            else : # reqeust to add a new session for user already have a wishlist
-                for s_key in request.sessionKeys:
-                    if ndb.Key(urlsafe=s_key) in wish.sessionKeys :
-                        raise ConflictException("%s Session is already added in your WishList."% s_key)
-                    else:
-                        wish.sessionKeys.append(ndb.Key(urlsafe=s_key))        
+                present.discard(key)
+            wish.sessionKeys = [key for key in wish.sessionKeys if key in present]
+        else :
+            for s_key, key in zip(request.sessionKeys, requested):
+                if key in present:
+                    raise ConflictException("%s Session is already added in your WishList."% s_key)
+                present.add(key)
+            wish.sessionKeys.extend(requested)
         wish.put()
 
-        sessions = [s_key.get() for s_key in wish.sessionKeys]
+        # one batch get instead of a get per session
+        sessions = ndb.get_multi(wish.sessionKeys)
+
+        # sessions are added anyway; clashes are only reported
+        conflicts = []
+        if not rem:
+            conflicts = self._scheduleConflicts(requested, wish.sessionKeys)
 
         return SessionForms(
-            sessions = [self._copySessionToForm(session) for session in sessions]) 
-        
+            sessions = [self._copySessionToForm(session) for session in sessions if session],
+            conflicts = conflicts)
+
 
     @endpoints.method(WishListRequestForm, SessionForms,
             path = 'conference/session/wishlist/add',
@@ -773,70 +2020,65 @@ class ConferenceApi(remote.Service):
     def getSessionsInWishlist(self, request):
         """ Used to get all sessions in users WishList"""
         prof = self._getProfileFromUser()
-        mainEmail = prof.mainEmail
-
-        wishes = WishList.query()
-        wishes = wishes.filter(WishList.mainEmail == mainEmail)
-        wish = wishes.get()
+        wish = self._getWishList(prof)
 
         if wish:
-            sessions = [s_key.get() for s_key in wish.sessionKeys]
+            sessions = ndb.get_multi(wish.sessionKeys)
         else:
             sessions = []
 
         return SessionForms(
-            sessions = [self._copySessionToForm(session) for session in sessions])
+            sessions = [self._copySessionToForm(session) for session in sessions if session])
 
 # - - - One Additional Endponts to search Session with various field combination - - - - - 
 
     def _getQuerySession(self, request):
-        """Return formatted query from the submitted filters."""
-        q = Session.query()
-        inequality_filter, filters = self._formatFiltersSession(request.filters)
-
-        # If exists, sort on inequality filter first
-        if not inequality_filter:
-            q = q.order(Session.startTime)
-        else:
-            q = q.order(ndb.GenericProperty(inequality_filter))
-            q = q.order(Session.startTime)
-
-        for filtr in filters:
-            if filtr["field"] in ["duration"]:
-                filtr["value"] = int(filtr["value"])
-            elif filtr['field'] == "startTime":
-                filtr["value"] = datetime.strptime("1970-01-01 "+filtr["value"],"%Y-%m-%d %H:%M")
-            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-            q = q.filter(formatted_query)
-        return q
+        """Return a planned query for the submitted filters, together with
+        the filters left to check in memory and the plan."""
+        filters = self._formatFiltersSession(request.filters)
+        field, pushed, residual, plan = self._planQuery('Session', filters)
+        q = self._buildQuery(Session, Session.startTime, field, pushed)
+        return q, residual, plan
 
 
     def _formatFiltersSession(self, filters):
-        """Parse, check validity and format user supplied filters."""
+        """Parse, check validity and format user supplied filters.
+        Values are converted to the types stored on Session."""
         formatted_filters = []
-        inequality_field = None
 
         for f in filters:
             filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
 
             try:
+                filtr["input"] = filtr["value"]
                 filtr["field"] = SESSIONFIELDS[filtr["field"].upper()]
                 filtr["operator"] = OPERATORS[filtr["operator"].upper()]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
 
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                # check if inequality operation has been used in previous filters
-                # disallow the filter if inequality was performed on a different field before
-                # track the field on which the inequality operation is performed
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
+            try:
+                if filtr["field"] in ["duration"]:
+                    filtr["value"] = int(filtr["value"])
+                elif filtr['field'] == "startTime":
+                    filtr["value"] = datetime.strptime("1970-01-01 "+filtr["value"],"%Y-%m-%d %H:%M")
+            except (TypeError, ValueError):
+                raise endpoints.BadRequestException(
+                    "Invalid value for %s: %s" % (filtr["field"], filtr["value"]))
 
             formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters)
+        return formatted_filters
+
+
+    def _querySessions(self, request):
+        """Run a planned session query and return matching SessionForms."""
+        sessions, residual, plan = self._getQuerySession(request)
+
+        # stream the results, converting only the sessions that match
+        return SessionForms(
+            sessions = [self._copySessionToForm(session)
+                        for session in sessions.iter(batch_size=QUERY_BATCH_SIZE)
+                        if self._entityMatches(session, residual)],
+            plan = plan if request.explain else [])
 
 
     @endpoints.method(SessionQueryForms, SessionForms,
@@ -845,10 +2087,7 @@ class ConferenceApi(remote.Service):
     def getSessionsWithFilters(self, request):
         """ Used to get all sessions with various filters and their
         combination """
-        sessions = self._getQuerySession(request)
-
-        return SessionForms(
-            sessions = [self._copySessionToForm(session) for session in sessions])
+        return self._querySessions(request)
 
     @endpoints.method(SessionQueryForms, SessionForms,
             path = 'conference/Session/get/twoInequality',
@@ -856,41 +2095,668 @@ class ConferenceApi(remote.Service):
     def getSessionsTwoInequality(self, request):
         """ Used to get all sessions in case two different field
             with inequality operator it will also work with equality operator"""
-        
-        try :
-            secondFilter = request.filters[1]
-            del request.filters[1]
-        except:
+        if len(request.filters) < 2:
             raise endpoints.BadRequestException("You should provide two fitering condition")
+        return self._querySessions(request)
+
+# - - - Search - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _searchTerms(text):
+        """Split text into lower case search terms, leaving out stop words
+        and terms too long to index."""
+        return [term for term in re.findall(r'\w+', text.lower(), re.UNICODE)
+                if term not in SEARCH_STOPWORDS and len(term if isinstance(term, bytes)
+                    else term.encode('utf-8')) <= SEARCH_MAX_TERM_BYTES]
 
-        sessions = self._getQuerySession(request)
-
-        sessionsforms = SessionForms(
-            sessions = [self._copySessionToForm(session) for session in sessions])
-
-        secondQuerySessions = copy.deepcopy(sessionsforms)
-        #--- Below code is to handle second inequality condition on different property ----
-        for s in sessionsforms.sessions:
-            if getattr(secondFilter, "operator") == "GT":
-                if getattr(s ,getattr(secondFilter,"field")) <= getattr(secondFilter, "value"):
-                    secondQuerySessions.sessions.remove(s)
-            elif getattr(secondFilter, "operator") == "LT":
-                if getattr(s ,getattr(secondFilter,"field")) >= getattr(secondFilter, "value"):
-                    secondQuerySessions.sessions.remove(s)
-            elif getattr(secondFilter, "operator") == "LTEQ":
-                if getattr(s ,getattr(secondFilter,"field")) > getattr(secondFilter, "value"):
-                    secondQuerySessions.sessions.remove(s)
-            elif getattr(secondFilter, "operator") == "GTEQ":
-                if getattr(s ,getattr(secondFilter,"field")) < getattr(secondFilter, "value"):
-                    secondQuerySessions.sessions.remove(s)
-            elif getattr(secondFilter, "operator") == "NE":
-                if getattr(s ,getattr(secondFilter,"field")) == getattr(secondFilter, "value"):
-                    secondQuerySessions.sessions.remove(s)
-            elif getattr(secondFilter, "operator") == "EQ":
-                if getattr(s ,getattr(secondFilter,"field")) != getattr(secondFilter, "value"):
-                    secondQuerySessions.sessions.remove(s)
-                 
-        return secondQuerySessions
+
+    @staticmethod
+    def _searchDocument(entity):
+        """Return the unsaved SearchDocument of a Conference or Session."""
+        kind = entity.key.kind()
+        weights = {}
+        for field, weight in SEARCH_FIELDS[kind].items():
+            value = getattr(entity, field, None)
+            for text in (value if isinstance(value, list) else [value]):
+                for term in ConferenceApi._searchTerms(text or ''):
+                    weights[term] = weights.get(term, 0) + weight
+        # a long description can't grow the index without bounds
+        terms = sorted(weights, key=lambda term: (-weights[term], term))[:SEARCH_MAX_TERMS]
+        return SearchDocument(key=ndb.Key(SearchDocument, 'text', parent=entity.key),
+            kind=kind, terms=terms,
+            weights=dict((term, weights[term]) for term in terms))
+
+
+    @staticmethod
+    def _rankSearch(documents, terms):
+        """Order SearchDocuments by the summed weight of the query terms,
+        ties by key so pages stay stable; returns the searched keys."""
+        documents = sorted(documents, key=lambda doc: (
+            -sum(doc.weights.get(term, 0) for term in terms), doc.key.urlsafe()))
+        return [doc.key.parent() for doc in documents]
+
+
+    @staticmethod
+    def _searchKeys(kind, terms, ancestor=None):
+        """Return the ranked keys of the kind entities holding all terms,
+        from memcache if the same search ran in the last
+        MEMCACHE_SEARCH_TTL seconds."""
+        # terms are kept in query order: only the first ones are filtered on
+        cache_key = MEMCACHE_SEARCH_KEY % hashlib.sha1(json.dumps(
+            [kind, ancestor.urlsafe() if ancestor else None, terms])).hexdigest()
+        cached = memcache.get(cache_key)
+        if cached is not None:
+            return [ndb.Key(urlsafe=key) for key in cached]
+
+        # equality filters on terms are merged over the built-in indexes,
+        # so any combination of words needs no composite index
+        q = SearchDocument.query(SearchDocument.kind == kind, ancestor=ancestor)
+        for term in terms[:SEARCH_MAX_QUERY_TERMS]:
+            q = q.filter(SearchDocument.terms == term)
+        keys = ConferenceApi._rankSearch(q.fetch(SEARCH_MAX_RESULTS), terms)
+        memcache.set(cache_key, [key.urlsafe() for key in keys],
+            time=MEMCACHE_SEARCH_TTL)
+        return keys
+
+
+    def _search(self, kind, request, ancestor=None):
+        """Return one page of the kind entities holding every word of
+        request.query, best match first, and the token of the next page."""
+        terms = []
+        for term in self._searchTerms(request.query or ''):
+            if term not in terms:
+                terms.append(term)
+        if not terms:
+            raise endpoints.BadRequestException("query has no searchable words.")
+        limit = request.limit or MAX_PAGE_SIZE
+        if limit < 0:
+            raise endpoints.BadRequestException("limit must be a positive number.")
+        limit = min(limit, MAX_PAGE_SIZE)
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+        if offset < 0:
+            raise endpoints.BadRequestException("Invalid pageToken.")
+
+        keys = self._searchKeys(kind, terms, ancestor)
+        entities = [e for e in ndb.get_multi(keys[offset:offset + limit]) if e]
+        next_token = str(offset + limit) if offset + limit < len(keys) else None
+        return entities, next_token
+
+
+    @staticmethod
+    def _indexSearchDocuments(kind, urlsafe_cursor=None):
+        """Create the missing SearchDocuments of one batch of kind entities
+        saved before search existed, then queue the next batch."""
+        model = {'Conference': Conference, 'Session': Session}[kind]
+        cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        entities, cursor, more = model.query().fetch_page(
+            QUERY_BATCH_SIZE, start_cursor=cursor)
+        documents = ndb.get_multi([ndb.Key(SearchDocument, 'text', parent=e.key)
+                                   for e in entities])
+        ndb.put_multi([ConferenceApi._searchDocument(e)
+                       for e, doc in zip(entities, documents) if not doc])
+        if more and cursor:
+            taskqueue.add(params={'kind': kind, 'cursor': cursor.urlsafe()},
+                url='/tasks/index_search')
+
+
+    @endpoints.method(SEARCH_REQUEST, ConferenceForms,
+            path='conferences/search',
+            http_method='GET', name='searchConferences')
+    def searchConferences(self, request):
+        """Search conference names, descriptions, cities and topics; all
+        words of query must match. Paged with limit and pageToken."""
+        conferences, next_token = self._search('Conference', request)
+        names = self._getOrganizerNames(conferences)
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf, names.get(conf.organizerUserId))
+                   for conf in conferences],
+            nextPageToken=next_token
+        )
+
+
+    @endpoints.method(SEARCH_REQUEST, SessionForms,
+            path='sessions/search',
+            http_method='GET', name='searchSessions')
+    def searchSessions(self, request):
+        """Search session names, highlights, speakers and types, optionally
+        within one conference; all words of query must match."""
+        ancestor = None
+        if request.websafeConferenceKey:
+            ancestor = ndb.Key(urlsafe=request.websafeConferenceKey)
+        sessions, next_token = self._search('Session', request, ancestor)
+        return SessionForms(
+            sessions=[self._copySessionToForm(session) for session in sessions],
+            nextPageToken=next_token
+        )
+
+
+# - - - Bulk import - - - - - - - - - - - - - - - - - - - - - - - -
+
+    @staticmethod
+    def _parseImport(body, fmt):
+        """Return the rows of a JSONL or CSV import as dicts. A JSONL line
+        that does not parse becomes a row holding only an '_error'."""
+        if fmt == 'csv':
+            # empty cells count as missing; topics are separated by ';'
+            return [dict((name, value) for name, value in row.items() if value)
+                    for row in csv.DictReader(body.splitlines())]
+        if fmt != 'jsonl':
+            raise ValueError("Unknown import format '%s'" % fmt)
+        rows = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {'_error': 'Invalid JSON: %s' % e}
+            if not isinstance(row, dict):
+                row = {'_error': 'Row is not a JSON object'}
+            rows.append(row)
+        return rows
+
+
+    @staticmethod
+    def _importConferenceData(row):
+        """Return Conference property values for a conference import row."""
+        if not row.get('name'):
+            raise ValueError("Conference 'name' field required")
+        if not row.get('organizerUserId'):
+            raise ValueError("Conference 'organizerUserId' field required")
+        data = dict((name, row.get(name)) for name in IMPORT_CONFERENCE_FIELDS)
+        if data['topics'] and not isinstance(data['topics'], list):
+            data['topics'] = [t.strip() for t in data['topics'].split(';') if t.strip()]
+        if data['maxAttendees'] is not None:
+            data['maxAttendees'] = int(data['maxAttendees'])
+        for df in DEFAULTS:
+            if data.get(df) in (None, []):
+                data[df] = list(DEFAULTS[df]) if isinstance(DEFAULTS[df], list) \
+                    else DEFAULTS[df]
+        return ConferenceApi._conferenceEntityData(data)
+
+
+    @staticmethod
+    def _importSessionData(row):
+        """Return Session property values for a session import row."""
+        if not row.get('name') or not row['name'].strip():
+            raise ValueError("Session 'name' field required")
+        data = dict((name, row.get(name)) for name in IMPORT_SESSION_FIELDS)
+        if data['duration'] is not None:
+            data['duration'] = int(data['duration'])
+        return ConferenceApi._sessionEntityData(data)
+
+
+    @staticmethod
+    def _importData(rows):
+        """Create the conferences and sessions described by import rows.
+
+        Each row has a 'type' of 'conference' or 'session'. A conference
+        row may carry a 'ref' that session rows of the same import give as
+        their 'conference'; otherwise that is a websafeConferenceKey. IDs
+        are allocated as one range per parent and entities are written
+        IMPORT_CHUNK_SIZE at a time; the featured speaker tasks of a
+        conference's chunks coalesce into one. Bad rows are skipped and
+        reported.
+
+        Returns ({ref: websafeConferenceKey}, sessions created,
+        [(row number, error message)])."""
+        # build every entity first: ndb checks property values when the
+        # entity is created, so a bad row is reported before any write
+        errors = []
+        conferences = []    # (row number, ref, Conference)
+        sessions = []       # (row number, conference, Session)
+        for number, row in enumerate(rows, 1):
+            try:
+                if row.get('_error'):
+                    raise ValueError(row['_error'])
+                kind = row.get('type')
+                if kind == 'conference':
+                    conferences.append((number, row.get('ref'),
+                        Conference(**ConferenceApi._importConferenceData(row))))
+                elif kind == 'session':
+                    sessions.append((number, row.get('conference'),
+                        Session(**ConferenceApi._importSessionData(row))))
+                else:
+                    raise ValueError("Unknown row type '%s'" % kind)
+            except (AttributeError, TypeError, ValueError,
+                    datastore_errors.BadValueError) as e:
+                errors.append((number, str(e)))
+
+        # sessions name a conference of this import or an existing one
+        refs = set(ref for number, ref, conf in conferences if ref)
+        keyed = []
+        bad = set()
+        for number, conference, session in sessions:
+            if conference in refs:
+                continue
+            try:
+                c_key = ndb.Key(urlsafe=conference)
+            except Exception:
+                c_key = None
+            if c_key is None or c_key.kind() != 'Conference':
+                bad.add(number)
+                errors.append((number, "Unknown conference '%s'" % conference))
+            else:
+                keyed.append((number, c_key))
+        existing = ndb.get_multi(list(set(c_key for number, c_key in keyed)))
+        existing = set(conf.key for conf in existing if conf)
+        for number, c_key in keyed:
+            if c_key not in existing:
+                bad.add(number)
+                errors.append((number, 'No conference found with key: %s'
+                    % c_key.urlsafe()))
+        sessions = [item for item in sessions if item[0] not in bad]
+
+        # conferences, with one ID range per organizer
+        by_organizer = {}
+        for item in conferences:
+            by_organizer.setdefault(item[2].organizerUserId, []).append(item)
+        refs = {}
+        confs = []
+        entities = []
+        organizers = list(by_organizer)
+        profiles = ndb.get_multi([ndb.Key(Profile, user_id) for user_id in organizers])
+        for user_id, prof in zip(organizers, profiles):
+            items = by_organizer[user_id]
+            p_key = ndb.Key(Profile, user_id)
+            first, last = Conference.allocate_ids(size=len(items), parent=p_key)
+            for c_id, (number, ref, conf) in zip(range(first, last + 1), items):
+                conf.key = ndb.Key(Conference, c_id, parent=p_key)
+                conf.organizerDisplayName = getattr(prof, 'displayName', None)
+                confs.append(conf)
+                entities.append(conf)
+                entities.append(ConferenceApi._searchDocument(conf))
+                entities.extend(ConferenceApi._newSeatShards(
+                    conf.key, conf.seatsAvailable))
+                if ref:
+                    refs[ref] = conf.key
+        for i in range(0, len(entities), IMPORT_CHUNK_SIZE):
+            ndb.put_multi(entities[i:i + IMPORT_CHUNK_SIZE])
+        if confs:
+            ConferenceApi._recordFieldStats('Conference',
+                added=[ConferenceApi._fieldValues(conf, FIELDS.values())
+                       for conf in confs])
+
+        # sessions, grouped by conference, with one ID range per conference
+        by_conference = {}
+        for number, conference, session in sessions:
+            c_key = refs.get(conference) or ndb.Key(urlsafe=conference)
+            by_conference.setdefault(c_key, []).append(session)
+
+        speaker_keys = ConferenceApi._resolveSpeakers(session.speaker
+            for items in by_conference.values() for session in items)
+        for items in by_conference.values():
+            for session in items:
+                session.speakerKey = speaker_keys.get(session.speaker)
+
+        created = 0
+        for c_key, new_sessions in by_conference.items():
+            first, last = Session.allocate_ids(size=len(new_sessions), parent=c_key)
+            for s_id, session in zip(range(first, last + 1), new_sessions):
+                session.key = ndb.Key(Session, s_id, parent=c_key)
+            for i in range(0, len(new_sessions), IMPORT_CHUNK_SIZE):
+                ConferenceApi._putSessions(new_sessions[i:i + IMPORT_CHUNK_SIZE])
+            created += len(new_sessions)
+
+        errors.sort()
+        return (dict((ref, key.urlsafe()) for ref, key in refs.items()),
+                created, errors)
+
+
+# - - - Query planning - - - - - - - - - - - - - - - - - - - - - - - -
+
+    def _planQuery(self, kind, filters, field=None):
+        """Choose which formatted filters of a query run on the datastore.
+
+        Only the filters on one field are sent, so the query needs at most
+        a (field, sort order) composite index and any number of fields can
+        carry inequalities; the other filters are checked in memory. The
+        field is the one whose filters match the fewest entities going by
+        the FieldStats of kind; ties go to the field with more filters,
+        then to the field named first. Passing field skips the choice.
+
+        Returns (field, pushed filters, residual filters, plan)."""
+        stats = ndb.Key(FieldStats, kind).get()
+        fields = []
+        for filtr in filters:
+            if filtr["field"] not in fields:
+                fields.append(filtr["field"])
+        by_field = dict((name, [f for f in filters if f["field"] == name])
+                        for name in fields)
+        estimates = dict((name, self._estimateSelectivity(stats, by_field[name]))
+                         for name in fields)
+
+        if field:
+            if field not in fields:
+                raise endpoints.BadRequestException("Invalid pageToken.")
+            best = field
+        elif fields:
+            best = min(fields, key=lambda name: (
+                estimates[name], -len(by_field[name]), fields.index(name)))
+        else:
+            best = None
+        pushed = [f for f in filters if f["field"] == best]
+        residual = [f for f in filters if f["field"] != best]
+        plan = [QueryPlanForm(field=f["field"], operator=f["operator"],
+                    value=f["input"], selectivity=estimates[f["field"]],
+                    pushedDown=f["field"] == best)
+                for f in filters]
+        return best, pushed, residual, plan
+
+
+    @staticmethod
+    def _estimateSelectivity(stats, filters):
+        """Estimate the fraction of entities matching all filters, which
+        are on one field, from the value counts kept in FieldStats. Values
+        beyond the counted ones are assumed to be spread evenly."""
+        if not stats or not stats.total:
+            return 1.0
+        field = filters[0]["field"]
+        tests = [(PY_OPERATORS[f["operator"]], ConferenceApi._statsValue(f["value"]))
+                 for f in filters]
+        counted = (stats.counts or {}).get(field, [])
+        matched = sum(count for value, count in counted
+                      if all(op(value, target) for op, target in tests))
+        count, distinct = (stats.others or {}).get(field, [0, 0])
+        # the others hold no counted value, so can't equal one
+        equals = set(ConferenceApi._statsValue(f["value"])
+                     for f in filters if f["operator"] == "=")
+        if equals & set(value for value, c in counted):
+            count = 0
+        if count:
+            operators = set(f["operator"] for f in filters)
+            if operators == set(["!="]):
+                matched += count
+            elif "=" in operators:
+                matched += float(count) / max(distinct, 1)
+            else:
+                matched += count / 2.0
+        return min(1.0, float(matched) / stats.total)
+
+
+    def _buildQuery(self, model, order, field, filters):
+        """Return a query of model running filters, all on field, on the
+        datastore, sorted by order."""
+        q = model.query()
+
+        # If exists, sort on inequality filter first
+        if any(f["operator"] != "=" for f in filters) and field != order._name:
+            q = q.order(ndb.GenericProperty(field))
+        q = q.order(order)
+        # key order keeps pages stable and lets "!=" queries use cursors
+        q = q.order(model.key)
+
+        for filtr in filters:
+            formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
+            q = q.filter(formatted_query)
+        return q
+
+
+    def _entityMatches(self, entity, filters):
+        """Return True if an entity satisfies all formatted filters. As on
+        the datastore, a repeated property matches if any value does and
+        a missing value never does."""
+        for filtr in filters:
+            value = getattr(entity, filtr["field"])
+            values = value if isinstance(value, list) else [value]
+            op = PY_OPERATORS[filtr["operator"]]
+            if not any(v is not None and op(v, filtr["value"]) for v in values):
+                return False
+        return True
+
+
+    @staticmethod
+    def _statsValue(value):
+        """Return value the way FieldStats stores it: JSON friendly and,
+        for dates and times, still ordered like the original."""
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        return value
+
+
+    @staticmethod
+    def _fieldValues(entity, fields):
+        """Return {field: [values]} for the non-empty fields of an entity."""
+        values = {}
+        for field in fields:
+            value = getattr(entity, field, None)
+            if value not in (None, []):
+                values[field] = value if isinstance(value, list) else [value]
+        return values
+
+
+    @staticmethod
+    def _recordFieldStats(kind, removed=(), added=()):
+        """Queue the change to the FieldStats of kind for entities whose
+        values (as returned by _fieldValues) were removed or added. Inside
+        a transaction the change is only queued if it commits. Saving an
+        entity never writes the FieldStats itself: _foldFieldStats applies
+        the queued changes in batches, stamped with the time they were
+        queued."""
+        removed, added = list(removed), list(added)
+        changes = {}
+        for values_list, step in ((removed, -1), (added, 1)):
+            for values in values_list:
+                for field, vals in values.items():
+                    for value in set(ConferenceApi._statsValue(v) for v in vals):
+                        changes[field, value] = changes.get((field, value), 0) + step
+        total = len(added) - len(removed)
+        changes = [[field, value, step]
+                   for (field, value), step in changes.items() if step]
+        if not (total or changes):
+            return
+        taskqueue.Queue(FIELD_STATS_QUEUE).add(taskqueue.Task(
+            payload=json.dumps({'total': total, 'changes': changes,
+                                'at': time.time()}),
+            method='PULL', tag=kind), transactional=ndb.in_transaction())
+
+
+    @staticmethod
+    def _foldFieldStats(kind):
+        """Apply the queued FieldStats changes of kind, a batch per
+        transaction. A batch is deleted from the queue once applied; if
+        the transaction fails, or a recount is running, it is leased
+        again when the lease runs out."""
+        queue = taskqueue.Queue(FIELD_STATS_QUEUE)
+        while True:
+            tasks = queue.lease_tasks_by_tag(FIELD_STATS_LEASE,
+                FIELD_STATS_BATCH, tag=kind)
+            if not tasks:
+                return
+            if not ConferenceApi._applyFieldStats(kind,
+                    [json.loads(task.payload) for task in tasks]):
+                return
+            queue.delete_tasks(tasks)
+            if len(tasks) < FIELD_STATS_BATCH:
+                return
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _applyFieldStats(kind, batch):
+        """Add a batch of queued changes to the FieldStats of kind, except
+        those queued before its last recount started, which the recount
+        has seen. Conference changes also go to its FacetCounts. Returns
+        False, changing nothing, while a recount runs."""
+        stats = ndb.Key(FieldStats, kind).get() or FieldStats(id=kind)
+        if ConferenceApi._rebuildingFieldStats(stats):
+            return False
+        counts = ConferenceApi._countsByValue(stats.counts)
+        others = stats.others or {}
+        facets = None
+        if kind == 'Conference':
+            facets = (ConferenceApi._facetCountsKey(kind).get() or
+                      FacetCounts(key=ConferenceApi._facetCountsKey(kind)))
+            facet_counts = ConferenceApi._countsByValue(facets.counts)
+        for change in batch:
+            if change.get('at', 0) < stats.rebuiltAt:
+                continue
+            stats.total = max(0, stats.total + change['total'])
+            for field, value, step in change['changes']:
+                field_counts = counts.setdefault(field, {})
+                if value in field_counts or step > 0 or field not in others:
+                    field_counts[value] = field_counts.get(value, 0) + step
+                else:
+                    # the value was only counted among the field's others
+                    others[field][0] = max(0, others[field][0] + step)
+                if facets:
+                    field_counts = facet_counts.setdefault(field, {})
+                    field_counts[value] = field_counts.get(value, 0) + step
+        stats.counts, stats.others = ConferenceApi._boundFieldStats(counts, others)
+        if facets:
+            facets.counts = ConferenceApi._sortedCounts(facet_counts)
+            ndb.put_multi([stats, facets])
+        else:
+            stats.put()
+        ConferenceApi._fieldStatsChanged(kind)
+        return True
+
+
+    @staticmethod
+    def _facetCountsKey(kind):
+        """Return the key of the FacetCounts of kind, a child of its
+        FieldStats so both are updated in one transaction."""
+        return ndb.Key(FieldStats, kind, FacetCounts, 'all')
+
+
+    @staticmethod
+    def _countsByValue(counts):
+        """Turn stored counts ({field: [[value, count]]}) into
+        {field: {value: count}}."""
+        return dict((field, dict((value, count) for value, count in pairs))
+                    for field, pairs in (counts or {}).items())
+
+
+    @staticmethod
+    def _sortedCounts(counts):
+        """Turn {field: {value: count}} into {field: [[value, count]]}, most
+        common first, leaving out values no longer held."""
+        sorted_counts = {}
+        for field, field_counts in counts.items():
+            values = sorted(([value, count] for value, count in field_counts.items()
+                             if count > 0), key=lambda vc: (-vc[1], vc[0]))
+            if values:
+                sorted_counts[field] = values
+        return sorted_counts
+
+
+    @staticmethod
+    def _rebuildingFieldStats(stats):
+        """Return True if a recount of stats started and has not timed out."""
+        return bool(stats.rebuildStarted and
+                    stats.rebuildStarted > time.time() - FIELD_STATS_REBUILD_TIMEOUT)
+
+
+    @staticmethod
+    def _boundFieldStats(counts, others):
+        """Return counts ({field: {value: count}}) as {field: [[value,
+        count]]}, most common first and at most STATS_MAX_VALUES values
+        per field, with the others ({field: [count, number of values]})
+        holding the rest."""
+        bounded = ConferenceApi._sortedCounts(counts)
+        others = dict(others)
+        for field, values in bounded.items():
+            if len(values) > STATS_MAX_VALUES:
+                count, distinct = others.get(field, [0, 0])
+                rest = values[STATS_MAX_VALUES:]
+                others[field] = [count + sum(c for v, c in rest), distinct + len(rest)]
+                bounded[field] = values[:STATS_MAX_VALUES]
+        return bounded, others
+
+
+    @staticmethod
+    def _rebuildFieldStats(kind):
+        """Recount the FieldStats of kind from the datastore, dropping any
+        drift left by failed updates. Each field is read with a projection
+        query, which yields one small row per entity and value. Folding
+        waits until the recount is saved; changes queued before it started
+        are then skipped, those queued after are applied on top."""
+        model, fields = {
+            'Conference': (Conference, FIELDS.values()),
+            'Session': (Session, SESSIONFIELDS.values()),
+        }[kind]
+        started = ConferenceApi._startFieldStatsRebuild(kind)
+        counts = {}
+        for field in fields:
+            field_counts = {}
+            for entity in model.query(projection=[field]).iter(
+                    batch_size=QUERY_BATCH_SIZE):
+                value = getattr(entity, field)
+                for v in (value if isinstance(value, list) else [value]):
+                    # _fieldValues leaves out empty values too
+                    if v is None:
+                        continue
+                    v = ConferenceApi._statsValue(v)
+                    field_counts[v] = field_counts.get(v, 0) + 1
+            counts[field] = field_counts
+        ConferenceApi._finishFieldStatsRebuild(kind, started,
+            model.query().count(), counts)
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _startFieldStatsRebuild(kind):
+        """Mark a recount of the FieldStats of kind as running; returns
+        the time it started."""
+        stats = ndb.Key(FieldStats, kind).get() or FieldStats(id=kind)
+        stats.rebuildStarted = time.time()
+        stats.put()
+        return stats.rebuildStarted
+
+
+    @staticmethod
+    @ndb.transactional()
+    def _finishFieldStatsRebuild(kind, started, total, counts):
+        """Save the recount ({field: {value: count}}) that started at
+        started, bounded for the planner and in full as the Conference
+        FacetCounts, unless a later recount has taken over since."""
+        stats = ndb.Key(FieldStats, kind).get()
+        if not stats or stats.rebuildStarted != started:
+            return
+        stats.total = total
+        stats.counts, stats.others = ConferenceApi._boundFieldStats(counts, {})
+        stats.rebuiltAt = started
+        stats.rebuildStarted = None
+        entities = [stats]
+        if kind == 'Conference':
+            entities.append(FacetCounts(key=ConferenceApi._facetCountsKey(kind),
+                counts=ConferenceApi._sortedCounts(counts)))
+        ndb.put_multi(entities)
+        ConferenceApi._fieldStatsChanged(kind)
+
+
+    @staticmethod
+    def _fieldStatsChanged(kind):
+        """Drop the cached facets once changed Conference counts are saved."""
+        if kind == 'Conference':
+            ndb.get_context().call_on_commit(
+                lambda: memcache.delete(MEMCACHE_FACETS_KEY))
+
+
+    @endpoints.method(message_types.VoidMessage, FacetForms,
+            path='conferences/facets',
+            http_method='GET', name='getConferenceFacets')
+    def getConferenceFacets(self, request):
+        """Return how many conferences hold each value of the fields
+        queryConferences filters on, most common value first."""
+        cached = memcache.get(MEMCACHE_FACETS_KEY)
+        if cached:
+            return protojson.decode_message(FacetForms, cached)
+
+        # every value is counted here, unlike the planner's FieldStats
+        stats, facet_counts = ndb.get_multi([ndb.Key(FieldStats, 'Conference'),
+            self._facetCountsKey('Conference')])
+        counts = (facet_counts.counts if facet_counts else None) or {}
+        facets = FacetForms(total=stats.total if stats else 0)
+        for name, field in sorted(FIELDS.items()):
+            facets.facets.append(FacetForm(field=name, values=[
+                FacetValueForm(value='%s' % value, count=count)
+                for value, count in counts.get(field, [])]))
+        memcache.set(MEMCACHE_FACETS_KEY, protojson.encode_message(facets))
+        return facets
 
     
 api = endpoints.api_server([ConferenceApi]) # register API
@@ -12,17 +12,29 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+import logging
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
 from conference import ConferenceApi
+from conference import CONFIRMATION_EMAIL_QUEUE
+
+# confirmations leased from the pull queue per batch, and how long a batch
+# may take before its unsent confirmations are leased again
+CONFIRMATION_EMAIL_BATCH = 100
+CONFIRMATION_EMAIL_LEASE = 60   # seconds
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
-        """Set Announcement in Memcache."""
-        # TODO 1
-        # use _cacheAnnouncement() to set announcement in Memcache
-        announcement =  ConferenceApi._cacheAnnouncement()        
+        """Reconcile the nearly sold out set & set Announcement in Memcache."""
+        announcement =  ConferenceApi._cacheAnnouncement()
+
+    def post(self):
+        """Recompute the Announcement when memcache lost it."""
+        self.get()
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
@@ -37,14 +49,140 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send the queued Conference confirmations, one email per
+        organizer and batch."""
+        queue = taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE)
+        while True:
+            tasks = queue.lease_tasks(CONFIRMATION_EMAIL_LEASE,
+                CONFIRMATION_EMAIL_BATCH)
+            by_email = {}
+            for task in tasks:
+                info = json.loads(task.payload)
+                by_email.setdefault(info['email'], []).append(
+                    (task, info['conferenceInfo']))
+            sent = []
+            for email, items in by_email.items():
+                try:
+                    mail.send_mail(
+                        'noreply@%s.appspotmail.com' % (
+                            app_identity.get_application_id()),     # from
+                        email,                                      # to
+                        'You created a new Conference!',            # subj
+                        'Hi, you have created the following '       # body
+                        'conference(s):\r\n\r\n%s' % '\r\n\r\n'.join(
+                            info for task, info in items)
+                    )
+                except Exception:
+                    # left leased, so retried once the lease runs out
+                    logging.exception('Could not send confirmation to %s', email)
+                    continue
+                sent.extend(task for task, info in items)
+            if sent:
+                queue.delete_tasks(sent)
+            if len(tasks) < CONFIRMATION_EMAIL_BATCH:
+                break
+
 class SetFeaturedSpeaker(webapp2.RequestHandler):
     def post(self):
-        """Sets the value for the feature speaker and sessions he is delivering."""
+        """Sets the value for the feature speaker and sessions he is delivering;
+        without a speaker, for whoever gives the most sessions."""
         announcement = ConferenceApi._featuredSpeaker(
             self.request.get('speaker'), self.request.get('websafeConferenceKey'))
 
+class SyncSeatsAvailableHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy a conference's sharded seat total onto the Conference."""
+        ConferenceApi._syncSeatsAvailable(
+            self.request.get('websafeConferenceKey'))
+
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Copy a changed Profile displayName onto the user's conferences."""
+        ConferenceApi._updateOrganizerName(self.request.get('userId'))
+
+class IndexAttendeesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start building the attendee roster from existing Profiles."""
+        ConferenceApi._indexAttendees()
+
+    def post(self):
+        """Index the next batch of Profiles."""
+        ConferenceApi._indexAttendees(self.request.get('cursor') or None)
+
+class IndexSpeakersHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start linking existing sessions to Speaker entities."""
+        ConferenceApi._indexSpeakers()
+
+    def post(self):
+        """Link the next batch of sessions."""
+        ConferenceApi._indexSpeakers(self.request.get('cursor') or None)
+
+class IndexTimelinesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start saving schedule timelines for existing conferences."""
+        ConferenceApi._indexTimelines()
+
+    def post(self):
+        """Save the timelines of the next batch of conferences."""
+        ConferenceApi._indexTimelines(self.request.get('cursor') or None)
+
+class IndexSearchHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start indexing existing conferences and sessions for search."""
+        ConferenceApi._indexSearchDocuments('Conference')
+        ConferenceApi._indexSearchDocuments('Session')
+
+    def post(self):
+        """Index the next batch of one kind."""
+        ConferenceApi._indexSearchDocuments(self.request.get('kind'),
+            self.request.get('cursor') or None)
+
+class FoldFieldStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Apply the queued changes to the field value counts."""
+        ConferenceApi._foldFieldStats('Conference')
+        ConferenceApi._foldFieldStats('Session')
+
+class RebuildFieldStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Recount the field values behind query planning and facets."""
+        ConferenceApi._rebuildFieldStats('Conference')
+        ConferenceApi._rebuildFieldStats('Session')
+
+class ImportHandler(webapp2.RequestHandler):
+    def post(self):
+        """Bulk import conferences and sessions from a JSONL or CSV body
+        (?format=jsonl|csv) and report what was created and skipped."""
+        try:
+            rows = ConferenceApi._parseImport(self.request.body,
+                self.request.get('format', 'jsonl'))
+        except Exception as e:
+            self.response.set_status(400)
+            self.response.write(str(e))
+            return
+        conferences, sessions, errors = ConferenceApi._importData(rows)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'conferences': conferences,
+            'sessions': sessions,
+            'errors': [{'row': row, 'error': error} for row, error in errors],
+        }))
+
 app = webapp2.WSGIApplication([
     ('/crons/set_announcement', SetAnnouncementHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
+    ('/crons/fold_field_stats', FoldFieldStatsHandler),
+    ('/crons/rebuild_field_stats', RebuildFieldStatsHandler),
     ('/tasks/setFeaturedSpeaker', SetFeaturedSpeaker),
+    ('/tasks/sync_seats', SyncSeatsAvailableHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/index_attendees', IndexAttendeesHandler),
+    ('/tasks/index_search', IndexSearchHandler),
+    ('/tasks/index_speakers', IndexSpeakersHandler),
+    ('/tasks/index_timelines', IndexTimelinesHandler),
+    ('/admin/import', ImportHandler),
 ], debug=True)
@@ -49,6 +49,27 @@ class Session(ndb.Model):
     typeOfSession = ndb.StringProperty()
     date = ndb.DateProperty()
     startTime = ndb.DateTimeProperty() #TimeProperty was not wroking as expected
+    speakerKey = ndb.KeyProperty(kind='Speaker')
+
+class ScheduleTimeline(ndb.Model):
+    """ScheduleTimeline -- the scheduled sessions of a Conference (the
+    parent) as [start, end, session id] sorted by start, times in minutes
+    since the epoch; maxEnd[i] is the latest end in the implicit search
+    tree node at i (the middle of its index range)"""
+    intervals = ndb.JsonProperty(compressed=True)
+    maxEnd = ndb.JsonProperty(compressed=True)
+
+class Speaker(ndb.Model):
+    """Speaker -- a session speaker, keyed by the normalised form of the
+    name so that spelling variants of it share one entity"""
+    name = ndb.StringProperty()
+
+class SpeakerSessions(ndb.Model):
+    """SpeakerSessions -- names of the sessions a speaker gives at one
+    Conference; child of the Conference, keyed like the Speaker"""
+    speaker = ndb.StringProperty()
+    sessionNames = ndb.StringProperty(repeated=True, indexed=False)
+    sessionCount = ndb.ComputedProperty(lambda self: len(self.sessionNames))
 
 class SessionForm(messages.Message):
     """SessionForm -- Session outbound form message"""
@@ -61,14 +82,104 @@ class SessionForm(messages.Message):
     startTime = messages.StringField(7)
     websafeSessionKey = messages.StringField(8)
 
+class QueryPlanForm(messages.Message):
+    """QueryPlanForm -- outbound explanation of one filter of a query plan"""
+    field = messages.StringField(1)
+    operator = messages.StringField(2)
+    value = messages.StringField(3)
+    selectivity = messages.FloatField(4)
+    pushedDown = messages.BooleanField(5)
+
+class FieldStats(ndb.Model):
+    """FieldStats -- number of entities of a kind holding each of the most
+    common values of its filterable fields, keyed by kind; read by the
+    query planner"""
+    total = ndb.IntegerProperty(default=0)
+    counts = ndb.JsonProperty()     # {field: [[value, count]]}, most common first
+    others = ndb.JsonProperty()     # {field: [count, number of values]} beyond those
+    rebuiltAt = ndb.FloatProperty(default=0)    # time.time() the last recount started
+    rebuildStarted = ndb.FloatProperty()        # set while a recount runs
+
+class FacetCounts(ndb.Model):
+    """FacetCounts -- number of entities of a kind holding each value of its
+    filterable fields, every value kept; child of the kind's FieldStats and
+    returned as facet counts"""
+    counts = ndb.JsonProperty(compressed=True)  # {field: [[value, count]]}, most common first
+
+class FacetValueForm(messages.Message):
+    """FacetValueForm -- number of conferences holding one field value"""
+    value = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+class FacetForm(messages.Message):
+    """FacetForm -- value counts of one filterable field"""
+    field = messages.StringField(1)
+    values = messages.MessageField(FacetValueForm, 2, repeated=True)
+
+class FacetForms(messages.Message):
+    """FacetForms -- value counts of every filterable Conference field"""
+    total = messages.IntegerField(1)
+    facets = messages.MessageField(FacetForm, 2, repeated=True)
+
 class SessionForms(messages.Message):
     """SessionForms -- Multiple Session outbound form messages"""
     sessions = messages.MessageField(SessionForm, 1, repeated=True)
+    plan = messages.MessageField(QueryPlanForm, 2, repeated=True)
+    nextPageToken = messages.StringField(3)
+    conflicts = messages.MessageField('ScheduleConflictForm', 4, repeated=True)
+
+class ScheduleConflictForm(messages.Message):
+    """ScheduleConflictForm -- wishlisted sessions that overlap a session"""
+    websafeSessionKey = messages.StringField(1)
+    conflictingSessionKeys = messages.StringField(2, repeated=True)
+
+class ScheduleConflictForms(messages.Message):
+    """ScheduleConflictForms -- multiple ScheduleConflictForm outbound messages"""
+    items = messages.MessageField(ScheduleConflictForm, 1, repeated=True)
+
+class SearchDocument(ndb.Model):
+    """SearchDocument -- search terms of a Conference or Session (the
+    parent), with the weight of each term for ranking"""
+    kind = ndb.StringProperty()
+    terms = ndb.StringProperty(repeated=True)
+    weights = ndb.JsonProperty()
 
 class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
     data = messages.BooleanField(1)
 
+class RegistrationRequestForm(messages.Message):
+    """RegistrationRequestForm -- conferences to register for in one call"""
+    websafeConferenceKeys = messages.StringField(1, repeated=True)
+
+class RegistrationResultForm(messages.Message):
+    """RegistrationResultForm -- outbound result of one batch registration"""
+    websafeConferenceKey = messages.StringField(1)
+    data = messages.BooleanField(2)
+    error = messages.StringField(3)
+
+class RegistrationResultForms(messages.Message):
+    """RegistrationResultForms -- multiple RegistrationResultForm outbound messages"""
+    items = messages.MessageField(RegistrationResultForm, 1, repeated=True)
+
+class Attendee(ndb.Model):
+    """Attendee -- registration of a Profile (the parent) for a Conference,
+    keyed by websafeConferenceKey; queried by conference for the roster"""
+    conference = ndb.KeyProperty(kind='Conference')
+    registered = ndb.DateTimeProperty(auto_now_add=True)
+
+class AttendeeForm(messages.Message):
+    """AttendeeForm -- one attendee of a conference outbound form message"""
+    displayName = messages.StringField(1)
+    mainEmail = messages.StringField(2)
+    teeShirtSize = messages.EnumField('TeeShirtSize', 3)
+    registered = messages.StringField(4)
+
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- one page of a conference's attendees"""
+    items = messages.MessageField(AttendeeForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
 class Conference(ndb.Model):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
@@ -81,6 +192,26 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    # copy of the organizer's Profile.displayName, kept current by a task
+    organizerDisplayName = ndb.StringProperty(indexed=False)
+
+class SeatShard(ndb.Model):
+    """SeatShard -- one slice of a Conference's available seats. Shards are
+    root entities so registrations don't all write the same entity group"""
+    seatsAvailable = ndb.IntegerProperty(default=0)
+
+class LowSeatsIndex(ndb.Model):
+    """LowSeatsIndex -- the nearly sold out conferences the announcement
+    lists, as {websafeConferenceKey: name}; a single entity"""
+    conferences = ndb.JsonProperty()
+
+class AnnouncementSnapshot(ndb.Model):
+    """AnnouncementSnapshot -- last value of a memcache announcement, keyed
+    by its memcache key, with the task (url, params) that recomputes it"""
+    data = ndb.TextProperty()
+    url = ndb.StringProperty(indexed=False)
+    params = ndb.JsonProperty()
+    updated = ndb.DateTimeProperty(auto_now=True)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -97,9 +228,22 @@ class ConferenceForm(messages.Message):
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
 
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm -- slim Conference outbound message for lists"""
+    name            = messages.StringField(1)
+    city            = messages.StringField(2)
+    startDate       = messages.StringField(3)
+    endDate         = messages.StringField(4)
+    maxAttendees    = messages.IntegerField(5)
+    seatsAvailable  = messages.IntegerField(6)
+    websafeKey      = messages.StringField(7)
+
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    plan = messages.MessageField(QueryPlanForm, 3, repeated=True)
+    summaries = messages.MessageField(ConferenceSummaryForm, 4, repeated=True)
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -138,6 +282,10 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    limit = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    explain = messages.BooleanField(4)
+    view = messages.StringField(5)  # 'full' (default) or 'summary'
 
 class SessionQueryForm(messages.Message):
     """ConferenceQueryForm -- Conference query inbound form message"""
@@ -148,6 +296,7 @@ class SessionQueryForm(messages.Message):
 class SessionQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    explain = messages.BooleanField(2)
 
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
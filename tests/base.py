@@ -0,0 +1,116 @@
+"""
+base.py -- shared set up for the conference app tests
+
+Run from the repository root with the App Engine Python SDK installed:
+
+    python -m unittest discover -s tests -t .
+
+Each test gets a fresh testbed with the stubs the API uses, a strongly
+consistent datastore and a signed in user.
+"""
+
+import contextlib
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+try:
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+except ImportError:
+    pass    # the SDK and its libraries are already on sys.path
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import users
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import conference
+from conference import ConferenceApi
+from models import Conference
+from models import ConferenceForm
+from models import Profile
+
+
+class TestCase(unittest.TestCase):
+    """TestCase -- testbed with datastore, memcache, taskqueue, mail and
+    urlfetch stubs; endpoints.get_current_user returns self.user"""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+                probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_mail_stub()
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_user_stub()
+        self.taskqueue = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        ndb.get_context().set_cache_policy(False)
+        ndb.get_context().clear_cache()
+
+        self._get_current_user = endpoints.get_current_user
+        endpoints.get_current_user = lambda: self.user
+        self.login('organizer@example.com')
+
+    def tearDown(self):
+        endpoints.get_current_user = self._get_current_user
+        self.testbed.deactivate()
+
+    def login(self, email):
+        """Make the following API calls as the user with email."""
+        self.user = users.User(email) if email else None
+
+    def api(self):
+        """Return a new service instance, as endpoints builds per request."""
+        return ConferenceApi()
+
+    def createConference(self, **fields):
+        """Create a conference as the current user; returns its key."""
+        fields.setdefault('name', 'Conference')
+        self.api().createConference(ConferenceForm(**fields))
+        # createConference returns the form without a key; IDs allocated
+        # under one profile increase, so the newest conference is the last
+        confs = Conference.query(ancestor=ndb.Key(Profile, self.user.email())).fetch()
+        return max(confs, key=lambda conf: conf.key.id()).key
+
+    def createSession(self, conf_key, **fields):
+        """Create a session of a conference as the current user; returns
+        its SessionForm."""
+        fields.setdefault('name', 'Session')
+        request = conference.SESSION_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=conf_key.urlsafe(), **fields)
+        return self.api().createSession(request)
+
+    def popTasks(self, url, queue_name='default'):
+        """Return the params of the push tasks queued for url, and empty
+        the queue; tests run the handlers' ConferenceApi calls themselves."""
+        tasks = self.taskqueue.get_filtered_tasks(url=url, queue_names=[queue_name])
+        self.taskqueue.FlushQueue(queue_name)
+        return [task.extract_params() for task in tasks]
+
+    @contextlib.contextmanager
+    def recordRpcs(self):
+        """Record the (service, call) of every API call made in the block,
+        e.g. ('datastore_v3', 'RunQuery')."""
+        calls = []
+        hooks = apiproxy_stub_map.apiproxy.GetPreCallHooks()
+        hooks.Append('record_rpcs',
+            lambda service, call, request, response: calls.append((service, call)))
+        try:
+            yield calls
+        finally:
+            hooks.Clear()
+
+    def datastoreCalls(self, calls, call):
+        """Return how many of the recorded calls are datastore calls."""
+        return calls.count(('datastore_v3', call))
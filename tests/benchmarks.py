@@ -0,0 +1,289 @@
+"""
+benchmarks.py -- wall time of the hot paths against the testbed stubs
+
+unittest discover only collects test*.py, so these never slow the tests
+down. Run them from the repository root with the SDK installed:
+
+    python -m tests.benchmarks              # all of them
+    python -m tests.benchmarks WishList     # those with WishList in their name
+
+Each benchmark prints the best wall time of REPEAT runs. The stubs are
+slower than production for datastore calls, so compare timings with each
+other, not with production latencies.
+"""
+
+from datetime import date
+from datetime import datetime
+import itertools
+import sys
+import threading
+import time
+import unittest
+
+import endpoints
+from google.appengine.api import datastore_errors
+from google.appengine.api import users
+from google.appengine.ext import ndb
+from protorpc import message_types
+
+import conference
+from tests.base import TestCase
+from conference import ConferenceApi
+from models import Conference
+from models import ConflictException
+from models import ConferenceForm
+from models import Profile
+from models import ProfileForm
+from models import RegistrationRequestForm
+from models import Session
+from models import SessionForm
+from models import SessionQueryForms
+from models import TeeShirtSize
+from models import WishList
+from models import WishListRequestForm
+
+REPEAT = 3
+
+# models.SessionQueryForm is redefined as another message; this is the filter
+SessionFilterForm = SessionQueryForms.filters.type
+
+
+class Benchmark(TestCase):
+    """Benchmark -- TestCase whose bench* methods are the benchmarks"""
+
+    def timeit(self, label, func, setup=None):
+        """Print the best wall time of func over REPEAT runs; setup, if
+        given, runs before each run and is not timed."""
+        best = None
+        for i in range(REPEAT):
+            if setup:
+                setup()
+            start = time.time()
+            func()
+            elapsed = time.time() - start
+            best = elapsed if best is None else min(best, elapsed)
+        sys.stdout.write('\n    %-60s %9.1f ms ' % (label, best * 1000))
+
+
+class WishListBenchmark(Benchmark):
+    """Edits of a 10k session wishlist and registration with 10k
+    conferences attended"""
+
+    SIZE = 10000
+    EDIT = 100
+
+    def setUp(self):
+        super(WishListBenchmark, self).setUp()
+        self.api().getProfile(message_types.VoidMessage())
+        self.p_key = ndb.Key(Profile, self.user.email())
+        conf_key = self.createConference(name='PyCon', maxAttendees=1000)
+        self.sessionKeys = [ndb.Key(Session, i + 1, parent=conf_key)
+                            for i in range(self.SIZE + self.EDIT)]
+
+    def resetWishList(self):
+        WishList(key=ndb.Key(WishList, self.p_key.id()), mainEmail=self.user.email(),
+                 sessionKeys=self.sessionKeys[:self.SIZE]).put()
+
+    def benchAddToWishList(self):
+        request = WishListRequestForm(sessionKeys=[
+            key.urlsafe() for key in self.sessionKeys[self.SIZE:]])
+        self.timeit('add %d sessions to a %d session wishlist' % (self.EDIT, self.SIZE),
+            lambda: self.api().addSessionToWishlist(request), self.resetWishList)
+
+    def benchRemoveFromWishList(self):
+        request = WishListRequestForm(sessionKeys=[
+            key.urlsafe() for key in self.sessionKeys[:self.SIZE:self.SIZE // self.EDIT]])
+        self.timeit('remove %d sessions from a %d session wishlist' % (self.EDIT, self.SIZE),
+            lambda: self.api().deleteSessionInWishlist(request), self.resetWishList)
+
+    def benchRegisterWhileAttending(self):
+        wscks = [self.createConference(name='Conf %d' % i, maxAttendees=1000).urlsafe()
+                 for i in range(10)]
+        def reset():
+            prof = self.p_key.get()
+            prof.conferenceKeysToAttend = ['conf-%d' % i for i in range(self.SIZE)]
+            prof.put()
+        request = RegistrationRequestForm(websafeConferenceKeys=wscks)
+        self.timeit('register for 10 conferences while attending %d' % self.SIZE,
+            lambda: self.api().registerForConferencesBatch(request), reset)
+
+
+class SessionFilterBenchmark(Benchmark):
+    """getSessionsTwoInequality over 10k and 100k sessions, with about
+    one in twenty matching both inequalities"""
+
+    def putSessions(self, size):
+        conf_key = self.createConference(name='PyCon')
+        sessions = [Session(parent=conf_key, name='Session %d' % i,
+                            duration=i % 200, typeOfSession='talk',
+                            startTime=datetime(1970, 1, 1, i % 24, 0))
+                    for i in range(size)]
+        for i in range(0, size, 500):
+            ndb.put_multi(sessions[i:i + 500])
+        ConferenceApi._rebuildFieldStats('Session')
+
+    def timeFilters(self, size):
+        self.putSessions(size)
+        request = SessionQueryForms(filters=[
+            SessionFilterForm(field='DURATION', operator='GT', value='179'),
+            SessionFilterForm(field='STARTTIME', operator='LT', value='12:00')])
+        forms = []
+        self.timeit('two inequalities over %d sessions' % size,
+            lambda: forms.append(self.api().getSessionsTwoInequality(request)))
+        sys.stdout.write('(%d matched)' % len(forms[-1].sessions))
+
+    def benchFilter10k(self):
+        self.timeFilters(10000)
+
+    def benchFilter100k(self):
+        self.timeFilters(100000)
+
+
+class CreateSessionBenchmark(Benchmark):
+    """createSession wall time and API calls per request"""
+
+    def benchCreateSession(self):
+        self.api().getProfile(message_types.VoidMessage())
+        conf_key = self.createConference(name='PyCon')
+        numbers = itertools.count()
+        with self.recordRpcs() as calls:
+            self.timeit('createSession with speaker and schedule',
+                lambda: self.createSession(conf_key, name='Session %d' % next(numbers),
+                    speaker='Jane Doe', duration=30, date='2026-06-01',
+                    startTime='09:00'))
+        sys.stdout.write('(%d calls, %d to the datastore, per request)' % (
+            len(calls) // REPEAT,
+            len([c for c in calls if c[0] == 'datastore_v3']) // REPEAT))
+
+
+class RegistrationThroughputBenchmark(Benchmark):
+    """registerForConference throughput with N registrants registering at
+    once, each for the same CONFERENCES conferences in turn. The stub locks
+    an entity group when a transaction first reads it, where production
+    only fails the later commit, so it fails more registrations than
+    production would."""
+
+    CONFERENCES = 5
+
+    def registrations(self, registrants):
+        wscks = [self.createConference(name='Conf %d' % i, maxAttendees=1000).urlsafe()
+                 for i in range(self.CONFERENCES)]
+        local = threading.local()
+        local.user = self.user
+        endpoints.get_current_user = lambda: local.user
+        results = []
+
+        def registrant(i):
+            local.user = users.User('attendee%d@example.com' % i)
+            for wsck in wscks:
+                try:
+                    results.append(self.api().registerForConference(
+                        conference.CONF_GET_REQUEST.combined_message_class(
+                            websafeConferenceKey=wsck)).data)
+                except (ConflictException, datastore_errors.TransactionFailedError):
+                    results.append(False)
+
+        threads = [threading.Thread(target=registrant, args=(i,))
+                   for i in range(registrants)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        sys.stdout.write('\n    %-60s %9.1f /s (%d of %d failed)' % (
+            '%d concurrent registrants' % registrants,
+            results.count(True) / elapsed,
+            results.count(False), registrants * self.CONFERENCES))
+
+    def benchRegistrations(self):
+        for registrants in (1, 5, 10, 25, 50):
+            self.registrations(registrants)
+
+
+def _copyByAllFields(form, entity, key_field=None):
+    """The per-entity all_fields() walk the _copy*ToForm helpers did
+    before their field lists were resolved at import; the baseline."""
+    for field in form.all_fields():
+        if hasattr(entity, field.name):
+            value = getattr(entity, field.name)
+            if field.name.endswith('Date') or field.name in ('startTime', 'date'):
+                value = str(value)
+            elif field.name == 'teeShirtSize':
+                value = getattr(TeeShirtSize, value)
+            setattr(form, field.name, value)
+        elif field.name == key_field:
+            setattr(form, field.name, entity.key.urlsafe())
+    form.check_initialized()
+    return form
+
+
+class FormConversionBenchmark(Benchmark):
+    """_copy*ToForm over 10k entities per model, against the all_fields()
+    walk they replaced"""
+
+    SIZE = 10000
+
+    def compare(self, label, entities, convert, baseline):
+        self.assertEqual(baseline(entities[0]), convert(entities[0]))
+        self.timeit('%s, all_fields() walk' % label,
+            lambda: [baseline(entity) for entity in entities])
+        self.timeit('%s, resolved at import' % label,
+            lambda: [convert(entity) for entity in entities])
+
+    def benchConferences(self):
+        p_key = ndb.Key(Profile, self.user.email())
+        conferences = [Conference(key=ndb.Key(Conference, i + 1, parent=p_key),
+            name='Conference %d' % i, description='About things', city='Paris',
+            topics=['Web', 'Python'], startDate=date(2026, 6, 1), month=6,
+            endDate=date(2026, 6, 3), maxAttendees=100, seatsAvailable=50,
+            organizerUserId=self.user.email(), organizerDisplayName='Ada')
+            for i in range(self.SIZE)]
+        api = self.api()
+        self.compare('%d conferences' % self.SIZE, conferences,
+            lambda conf: api._copyConferenceToForm(conf, 'Ada'),
+            lambda conf: _copyByAllFields(ConferenceForm(), conf, 'websafeKey'))
+
+    def benchSessions(self):
+        conf_key = ndb.Key(Conference, 1, parent=ndb.Key(Profile, self.user.email()))
+        sessions = [Session(key=ndb.Key(Session, i + 1, parent=conf_key),
+            name='Session %d' % i, highlights='Things', speaker='Jane Doe',
+            duration=45, typeOfSession='talk', date=date(2026, 6, 1),
+            startTime=datetime(1970, 1, 1, 9, 30))
+            for i in range(self.SIZE)]
+        api = self.api()
+        self.compare('%d sessions' % self.SIZE, sessions,
+            api._copySessionToForm,
+            lambda session: _copyByAllFields(SessionForm(), session, 'websafeSessionKey'))
+
+    def benchProfiles(self):
+        profiles = [Profile(key=ndb.Key(Profile, 'user%d@example.com' % i),
+            displayName='User %d' % i, mainEmail='user%d@example.com' % i,
+            teeShirtSize='M_M', conferenceKeysToAttend=['conf'])
+            for i in range(self.SIZE)]
+        api = self.api()
+        self.compare('%d profiles' % self.SIZE, profiles,
+            api._copyProfileToForm,
+            lambda prof: _copyByAllFields(ProfileForm(), prof))
+
+
+def _tests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            for t in _tests(test):
+                yield t
+        else:
+            yield test
+
+
+def main(names):
+    loader = unittest.TestLoader()
+    loader.testMethodPrefix = 'bench'
+    suite = unittest.TestSuite([test
+        for test in _tests(loader.loadTestsFromModule(sys.modules[__name__]))
+        if not names or any(name in test.id() for name in names)])
+    unittest.TextTestRunner(verbosity=2).run(suite)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,85 @@
+"""Tests for the announcements served from memcache, their datastore
+snapshots and the deduplicated recompute task."""
+
+import time
+import unittest
+
+from google.appengine.api import memcache
+from protorpc import message_types
+
+from tests.base import TestCase
+from conference import ConferenceApi
+
+
+class AnnouncementTest(TestCase):
+
+    def setUp(self):
+        super(AnnouncementTest, self).setUp()
+        self._time = time.time
+        # in the middle of one refresh interval, whenever the test runs
+        time.time = lambda: 1000000030.0
+
+    def tearDown(self):
+        time.time = self._time
+        super(AnnouncementTest, self).tearDown()
+
+    def announcement(self):
+        return self.api().getAnnouncement(message_types.VoidMessage()).data
+
+    def featuredSpeaker(self):
+        return self.api().getFeaturedSpeaker(message_types.VoidMessage()).data
+
+    def testSnapshotIsServedWhenMemcacheLosesIt(self):
+        self.createConference(name='PyCon', maxAttendees=3)
+        ConferenceApi._cacheAnnouncement()
+        memcache.flush_all()
+        self.assertIn('PyCon', self.announcement())
+        self.assertEqual(1, len(self.popTasks('/crons/set_announcement')))
+        # the snapshot went back into memcache, so this is a plain hit
+        self.assertIn('PyCon', self.announcement())
+        self.assertEqual([], self.popTasks('/crons/set_announcement'))
+
+    def testMissWithoutSnapshotQueuesOneRecompute(self):
+        self.createConference(name='PyCon', maxAttendees=3)
+        self.assertEqual('', self.announcement())
+        self.assertEqual('', self.announcement())
+        tasks = self.taskqueue.get_filtered_tasks(url='/crons/set_announcement')
+        self.assertEqual(1, len(tasks))
+
+        ConferenceApi._cacheAnnouncement()      # what the task runs
+        self.assertIn('PyCon', self.announcement())
+
+    def testFeaturedSpeakerWithoutSnapshotIsRecomputed(self):
+        conf_key = self.createConference(name='PyCon')
+        self.createSession(conf_key, name='Intro', speaker='Jane Doe')
+        self.createSession(conf_key, name='Advanced', speaker='Jane Doe')
+        self.popTasks('/tasks/setFeaturedSpeaker')
+
+        self.assertEqual('', self.featuredSpeaker())
+        self.assertEqual('', self.featuredSpeaker())
+        tasks = self.popTasks('/tasks/setFeaturedSpeaker')
+        self.assertEqual([{}], tasks)
+
+        # what the task runs, without a speaker or conference
+        ConferenceApi._featuredSpeaker('', '')
+        memcache.flush_all()
+        self.assertIn('Jane Doe', self.featuredSpeaker())
+        # the recompute's snapshot names the conference this time
+        self.assertEqual([{'speaker': 'Jane Doe',
+                           'websafeConferenceKey': conf_key.urlsafe()}],
+                         self.popTasks('/tasks/setFeaturedSpeaker'))
+
+    def testNobodyToFeatureIsStored(self):
+        self.assertEqual('', self.featuredSpeaker())
+        ConferenceApi._featuredSpeaker('', '')
+        self.popTasks('/tasks/setFeaturedSpeaker')
+        memcache.flush_all()
+        self.assertEqual('', self.featuredSpeaker())
+        # the empty snapshot is served and refreshed like any other
+        self.assertEqual(1, len(self.popTasks('/tasks/setFeaturedSpeaker')))
+        self.assertEqual('', self.featuredSpeaker())
+        self.assertEqual([], self.popTasks('/tasks/setFeaturedSpeaker'))
+
+
+if __name__ == '__main__':
+    unittest.main()
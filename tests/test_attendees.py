@@ -0,0 +1,67 @@
+"""Tests for the conference attendee roster getConferenceAttendees pages."""
+
+import unittest
+
+import endpoints
+
+import conference
+from tests.base import TestCase
+
+
+class AttendeesTest(TestCase):
+
+    def setUp(self):
+        super(AttendeesTest, self).setUp()
+        self.conf_key = self.createConference(name='PyCon', maxAttendees=20)
+        self.wsck = self.conf_key.urlsafe()
+
+    def register(self, email, reg=True):
+        self.login(email)
+        request = conference.CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=self.wsck)
+        if reg:
+            return self.api().registerForConference(request).data
+        return self.api().unregisterFromConference(request).data
+
+    def attendees(self, **fields):
+        self.login('organizer@example.com')
+        return self.api().getConferenceAttendees(
+            conference.ATTENDEES_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck, **fields))
+
+    def testOnlyOrganizerSeesAttendees(self):
+        self.register('attendee@example.com')
+        self.assertRaises(endpoints.ForbiddenException,
+            self.api().getConferenceAttendees,
+            conference.ATTENDEES_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck))
+        self.assertEqual(['attendee@example.com'],
+                         [af.mainEmail for af in self.attendees().items])
+
+    def testPagesInRegistrationOrder(self):
+        emails = ['attendee%d@example.com' % i for i in (3, 1, 4, 0, 2)]
+        for email in emails:
+            self.register(email)
+        seen = []
+        page = self.attendees(limit=2)
+        seen.extend(af.mainEmail for af in page.items)
+        while page.nextPageToken:
+            page = self.attendees(limit=2, pageToken=page.nextPageToken)
+            self.assertTrue(len(page.items) <= 2)
+            seen.extend(af.mainEmail for af in page.items)
+        self.assertEqual(emails, seen)
+
+    def testUnregisterRemovesAttendee(self):
+        self.register('first@example.com')
+        self.register('second@example.com')
+        self.register('first@example.com', reg=False)
+        self.assertEqual(['second@example.com'],
+                         [af.mainEmail for af in self.attendees().items])
+
+    def testInvalidPageTokenIsRejected(self):
+        self.assertRaises(endpoints.BadRequestException,
+            self.attendees, pageToken='not a cursor')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+"""Tests for the memcached ConferenceForm getConference serves."""
+
+import unittest
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import conference
+from tests.base import TestCase
+
+
+class ConferenceCacheTest(TestCase):
+
+    def setUp(self):
+        super(ConferenceCacheTest, self).setUp()
+        # count the datastore reads themselves, not ndb's memcache hits
+        ndb.get_context().set_memcache_policy(False)
+        self.conf_key = self.createConference(name='PyCon', maxAttendees=20)
+        self.wsck = self.conf_key.urlsafe()
+
+    def get(self):
+        return self.api().getConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck))
+
+    def testHitSkipsDatastore(self):
+        self.get()
+        with self.recordRpcs() as calls:
+            cf = self.get()
+        self.assertEqual('PyCon', cf.name)
+        self.assertEqual(self.wsck, cf.websafeKey)
+        self.assertEqual(0, len([c for c in calls if c[0] == 'datastore_v3']))
+        # the hit counter is bumped without waiting for it
+        self.assertIn(('memcache', 'Increment'), calls)
+
+    def testUpdateInvalidatesForm(self):
+        self.get()
+        self.api().updateConference(
+            conference.CONF_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck, name='PyCon 2026'))
+        self.assertEqual(None, memcache.get(conference.MEMCACHE_CONFERENCE_KEY % self.wsck))
+        self.assertEqual('PyCon 2026', self.get().name)
+
+    def testRegistrationInvalidatesForm(self):
+        self.assertEqual(20, self.get().seatsAvailable)
+        self.login('attendee@example.com')
+        self.api().registerForConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck))
+        self.assertEqual(None, memcache.get(conference.MEMCACHE_CONFERENCE_KEY % self.wsck))
+        self.assertEqual(19, self.get().seatsAvailable)
+        self.api().unregisterFromConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck))
+        self.assertEqual(20, self.get().seatsAvailable)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+"""Tests for the FieldStats behind query planning and facets."""
+
+import unittest
+
+from google.appengine.ext import ndb
+from protorpc import message_types
+
+import conference
+from tests.base import TestCase
+from conference import ConferenceApi
+from models import Conference
+from models import FieldStats
+
+
+class FieldStatsTest(TestCase):
+
+    def stats(self, kind='Conference'):
+        return ndb.Key(FieldStats, kind).get()
+
+    def testChangesAreQueuedThenFolded(self):
+        self.createConference(name='One', city='Paris', topics=['Web', 'Python'])
+        self.createConference(name='Two', city='Paris', topics=['Python'])
+        # saving a conference leaves the FieldStats alone
+        self.assertIsNone(self.stats())
+
+        ConferenceApi._foldFieldStats('Conference')
+        stats = self.stats()
+        self.assertEqual(2, stats.total)
+        self.assertEqual([['Paris', 2]], stats.counts['city'])
+        self.assertEqual([['Python', 2], ['Web', 1]], stats.counts['topics'])
+        self.assertEqual([], self.taskqueue.get_filtered_tasks(
+            queue_names=[conference.FIELD_STATS_QUEUE]))
+
+        facets = self.api().getConferenceFacets(message_types.VoidMessage())
+        city = [f for f in facets.facets if f.field == 'CITY'][0]
+        self.assertEqual([('Paris', 2)], [(v.value, v.count) for v in city.values])
+
+    def testRareValuesAreCountedTogether(self):
+        self._max_values = conference.STATS_MAX_VALUES
+        conference.STATS_MAX_VALUES = 2
+        try:
+            for city in ['Paris', 'Paris', 'Paris', 'Rome', 'Rome', 'Oslo', 'Lima']:
+                self.createConference(city=city)
+            ConferenceApi._foldFieldStats('Conference')
+        finally:
+            conference.STATS_MAX_VALUES = self._max_values
+        stats = self.stats()
+        self.assertEqual([['Paris', 3], ['Rome', 2]], stats.counts['city'])
+        self.assertEqual([2, 2], stats.others['city'])
+        # facets still count every value
+        facets = self.api().getConferenceFacets(message_types.VoidMessage())
+        city = [f for f in facets.facets if f.field == 'CITY'][0]
+        self.assertEqual([('Paris', 3), ('Rome', 2), ('Lima', 1), ('Oslo', 1)],
+                         [(v.value, v.count) for v in city.values])
+
+        def estimate(operator, value):
+            return ConferenceApi._estimateSelectivity(stats,
+                [{'field': 'city', 'operator': operator, 'value': value}])
+        self.assertAlmostEqual(3 / 7.0, estimate('=', 'Paris'))
+        self.assertAlmostEqual(1 / 7.0, estimate('=', 'Oslo'))
+        self.assertAlmostEqual(5 / 7.0, estimate('!=', 'Rome'))
+
+
+class RebuildFieldStatsTest(TestCase):
+
+    def stats(self):
+        return ndb.Key(FieldStats, 'Conference').get()
+
+    def testEmptyValuesAreLeftOut(self):
+        Conference(name='Bare').put()
+        ConferenceApi._rebuildFieldStats('Conference')
+        stats = self.stats()
+        self.assertEqual(1, stats.total)
+        self.assertEqual({}, stats.counts)
+
+    def testRecountKeepsEveryFacetValue(self):
+        self._max_values = conference.STATS_MAX_VALUES
+        conference.STATS_MAX_VALUES = 1
+        try:
+            for city in ['Paris', 'Paris', 'Rome']:
+                self.createConference(city=city)
+            ConferenceApi._rebuildFieldStats('Conference')
+        finally:
+            conference.STATS_MAX_VALUES = self._max_values
+        self.assertEqual([['Paris', 2]], self.stats().counts['city'])
+        facets = self.api().getConferenceFacets(message_types.VoidMessage())
+        city = [f for f in facets.facets if f.field == 'CITY'][0]
+        self.assertEqual([('Paris', 2), ('Rome', 1)],
+                         [(v.value, v.count) for v in city.values])
+
+    def testChangesQueuedBeforeTheRecountAreSkipped(self):
+        self.createConference(city='Paris')
+        self.createConference(city='Rome')
+        ConferenceApi._rebuildFieldStats('Conference')
+        self.createConference(city='Paris')
+
+        ConferenceApi._foldFieldStats('Conference')
+        stats = self.stats()
+        self.assertEqual(3, stats.total)
+        self.assertEqual([['Paris', 2], ['Rome', 1]], stats.counts['city'])
+
+    def testFoldingWaitsForARunningRecount(self):
+        self.createConference(city='Paris')
+        ConferenceApi._startFieldStatsRebuild('Conference')
+        ConferenceApi._foldFieldStats('Conference')
+        self.assertEqual(0, self.stats().total)
+        self.assertEqual(1, len(self.taskqueue.get_filtered_tasks(
+            queue_names=[conference.FIELD_STATS_QUEUE])))
+
+
+if __name__ == '__main__':
+    unittest.main()
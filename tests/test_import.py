@@ -0,0 +1,64 @@
+"""Tests for the admin bulk import."""
+
+import json
+import unittest
+
+from tests.base import TestCase
+from conference import ConferenceApi
+from models import Conference
+from models import Session
+
+
+class ImportTest(TestCase):
+
+    def importJsonl(self, rows):
+        body = '\n'.join(json.dumps(row) for row in rows)
+        return ConferenceApi._importData(ConferenceApi._parseImport(body, 'jsonl'))
+
+    def testImportsConferencesAndSessions(self):
+        refs, sessions, errors = self.importJsonl([
+            {'type': 'conference', 'ref': 'c1', 'name': 'PyCon',
+             'organizerUserId': 'organizer@example.com', 'maxAttendees': 10},
+            {'type': 'session', 'conference': 'c1', 'name': 'Keynote',
+             'speaker': 'Ada', 'duration': 60},
+            {'type': 'session', 'conference': 'c1', 'name': 'Talk'},
+        ])
+        self.assertEqual([], errors)
+        self.assertEqual(2, sessions)
+        conf_key = Conference.query().get().key
+        self.assertEqual(conf_key.urlsafe(), refs['c1'])
+        self.assertEqual(2, Session.query(ancestor=conf_key).count())
+
+    def testBadPropertyValueIsReportedBeforeAnyWrite(self):
+        # ndb rejects a non-string highlights when the Session is built
+        refs, sessions, errors = self.importJsonl([
+            {'type': 'conference', 'ref': 'c1', 'name': 'PyCon',
+             'organizerUserId': 'organizer@example.com'},
+            {'type': 'session', 'conference': 'c1', 'name': 'x', 'highlights': 5},
+            {'type': 'session', 'conference': 'c1', 'name': 'ok'},
+        ])
+        self.assertEqual([2], [number for number, error in errors])
+        self.assertEqual(1, sessions)
+        self.assertEqual(['ok'], [s.name for s in Session.query()])
+
+    def testUnknownConferenceAndBadJson(self):
+        body = '{"type": "session", "conference": "nope", "name": "x"}\nnot json\n'
+        refs, sessions, errors = ConferenceApi._importData(
+            ConferenceApi._parseImport(body, 'jsonl'))
+        self.assertEqual([1, 2], [number for number, error in errors])
+        self.assertEqual(0, sessions)
+        self.assertEqual(0, Session.query().count())
+
+    def testCsv(self):
+        body = ('type,ref,conference,name,organizerUserId,topics\n'
+                'conference,c1,,PyCon,organizer@example.com,web;data\n'
+                'session,,c1,Keynote,,\n')
+        refs, sessions, errors = ConferenceApi._importData(
+            ConferenceApi._parseImport(body, 'csv'))
+        self.assertEqual([], errors)
+        self.assertEqual(1, sessions)
+        self.assertEqual(['web', 'data'], Conference.query().get().topics)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+"""Tests for profiles and the organizer name copied onto conferences."""
+
+import unittest
+
+import endpoints
+from google.appengine.ext import ndb
+from protorpc import message_types
+
+from tests.base import TestCase
+from conference import ConferenceApi
+from models import ProfileMiniForm
+
+
+class OrganizerNameTest(TestCase):
+
+    def testNameChangeReachesConferences(self):
+        self.api().getProfile(message_types.VoidMessage())     # creates the profile
+        conf_key = self.createConference(name='PyCon', city='Paris')
+        self.assertEqual(self.user.nickname(), conf_key.get().organizerDisplayName)
+
+        self.api().saveProfile(ProfileMiniForm(displayName='Ada'))
+        tasks = self.popTasks('/tasks/update_organizer_name')
+        self.assertEqual(1, len(tasks))
+        ConferenceApi._updateOrganizerName(tasks[0]['userId'])
+
+        conf = conf_key.get()
+        self.assertEqual('Ada', conf.organizerDisplayName)
+        # the rest of the conference is left as it was
+        self.assertEqual('Paris', conf.city)
+
+    def testUnchangedNameQueuesNothing(self):
+        self.api().getProfile(message_types.VoidMessage())
+        self.api().saveProfile(ProfileMiniForm(displayName=self.user.nickname()))
+        self.assertEqual([], self.popTasks('/tasks/update_organizer_name'))
+
+
+class ProfileMemoTest(TestCase):
+
+    def testProfileIsReadOncePerRequest(self):
+        api = self.api()
+        prof = api._getProfileFromUser()
+        endpoints.get_current_user = lambda: self.fail('looked up the user again')
+        self.assertIs(prof, api._getProfileFromUser())
+
+    def testTransactionReadsAgainAndUpdatesMemo(self):
+        api = self.api()
+        api._getProfileFromUser()
+
+        @ndb.transactional()
+        def register():
+            prof = api._getProfileFromUser()
+            prof.conferenceKeysToAttend.append('conf')
+            prof.put()
+            return prof
+        saved = register()
+        self.assertIs(saved, api._getProfileFromUser())
+        self.assertEqual(['conf'], api._getProfileFromUser().conferenceKeysToAttend)
+
+
+if __name__ == '__main__':
+    unittest.main()
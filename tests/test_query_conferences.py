@@ -0,0 +1,73 @@
+"""Tests for queryConferences paging, views and query planning."""
+
+import unittest
+
+import conference
+from tests.base import TestCase
+from models import ConferenceQueryForm
+from models import ConferenceQueryForms
+
+
+class QueryConferencesTest(TestCase):
+
+    def query(self, filters=(), **fields):
+        return self.api().queryConferences(ConferenceQueryForms(
+            filters=[ConferenceQueryForm(field=f, operator=o, value=v)
+                     for f, o, v in filters], **fields))
+
+    def testSummaryViewPagesWithPushedFilter(self):
+        # the CITY filter runs on the datastore and the first page has a
+        # next page: the summary branch still needs the filter dicts
+        self.createConference(name='One', city='Paris')
+        self.createConference(name='Two', city='Paris')
+        self.createConference(name='Three', city='Rome')
+
+        first = self.query([('CITY', 'EQ', 'Paris')], limit=1, view='summary')
+        self.assertEqual(1, len(first.summaries))
+        self.assertEqual('Paris', first.summaries[0].city)
+        self.assertTrue(first.nextPageToken)
+
+        second = self.query([('CITY', 'EQ', 'Paris')], limit=1, view='summary',
+            pageToken=first.nextPageToken)
+        self.assertEqual(1, len(second.summaries))
+        self.assertEqual('Paris', second.summaries[0].city)
+        self.assertNotEqual(first.summaries[0].websafeKey,
+                            second.summaries[0].websafeKey)
+        self.assertFalse(second.nextPageToken)
+
+    def testFullViewPages(self):
+        for i in range(3):
+            self.createConference(name='Conf %d' % i, city='Paris')
+        seen = []
+        token = None
+        while True:
+            page = self.query([('CITY', 'EQ', 'Paris')], limit=2, pageToken=token)
+            seen.extend(cf.websafeKey for cf in page.items)
+            token = page.nextPageToken
+            if not token:
+                break
+        self.assertEqual(3, len(set(seen)))
+
+    def testScanIsCappedPerPage(self):
+        # CITY runs on the datastore and TOPIC in memory; only the last of
+        # four conferences matches both
+        for name in ['A', 'B', 'C']:
+            self.createConference(name=name, city='Paris', topics=['Python'])
+        self.createConference(name='D', city='Paris', topics=['Web'])
+        filters = [('CITY', 'EQ', 'Paris'), ('TOPIC', 'EQ', 'Web')]
+
+        max_scan = conference.MAX_SCAN_PER_PAGE
+        conference.MAX_SCAN_PER_PAGE = 2
+        try:
+            first = self.query(filters, limit=10)
+            second = self.query(filters, limit=10, pageToken=first.nextPageToken)
+        finally:
+            conference.MAX_SCAN_PER_PAGE = max_scan
+        self.assertEqual([], first.items)
+        self.assertTrue(first.nextPageToken)
+        self.assertEqual(['D'], [cf.name for cf in second.items])
+        self.assertFalse(second.nextPageToken)
+
+
+if __name__ == '__main__':
+    unittest.main()
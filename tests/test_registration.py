@@ -0,0 +1,187 @@
+"""Tests for registration against sharded seats and seat edits."""
+
+import threading
+import unittest
+
+import endpoints
+from google.appengine.api import datastore_errors
+from google.appengine.api import memcache
+from google.appengine.api import users
+from google.appengine.ext import ndb
+
+import conference
+from tests.base import TestCase
+from conference import ConferenceApi
+from models import ConflictException
+from models import LowSeatsIndex
+from models import Profile
+
+
+class RegistrationTest(TestCase):
+
+    def setUp(self):
+        super(RegistrationTest, self).setUp()
+        self.conf_key = self.createConference(name='PyCon', maxAttendees=20)
+        self.wsck = self.conf_key.urlsafe()
+
+    def register(self):
+        return self.api().registerForConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck)).data
+
+    def update(self, **fields):
+        return self.api().updateConference(
+            conference.CONF_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck, **fields))
+
+    def shardSeats(self):
+        return sum(sh.seatsAvailable for sh in
+                   ndb.get_multi(ConferenceApi._seatShardKeys(self.conf_key)))
+
+    def attendees(self):
+        return len([prof for prof in Profile.query()
+                    if self.wsck in prof.conferenceKeysToAttend])
+
+    def testConcurrentRegistrantsDontOversell(self):
+        local = threading.local()
+        endpoints.get_current_user = lambda: local.user
+        results = []
+
+        def registrant(i):
+            local.user = users.User('attendee%d@example.com' % i)
+            try:
+                results.append(self.register())
+            except (ConflictException, datastore_errors.TransactionFailedError):
+                results.append(False)
+
+        threads = [threading.Thread(target=registrant, args=(i,)) for i in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        registered = results.count(True)
+        self.assertEqual(50, len(results))
+        self.assertTrue(0 < registered <= 20)
+        self.assertEqual(registered, self.attendees())
+        self.assertEqual(20 - registered, self.shardSeats())
+
+    def testSoldOut(self):
+        for i in range(20):
+            self.login('attendee%d@example.com' % i)
+            self.assertTrue(self.register())
+        self.login('late@example.com')
+        self.assertRaises(ConflictException, self.register)
+        self.assertEqual(0, self.shardSeats())
+
+    def testMaxAttendeesEditResizesShards(self):
+        for i in range(3):
+            self.login('attendee%d@example.com' % i)
+            self.register()
+        self.login('organizer@example.com')
+
+        self.assertEqual(27, self.update(maxAttendees=30).seatsAvailable)
+        self.assertEqual(27, self.shardSeats())
+        self.assertEqual(2, self.update(maxAttendees=5).seatsAvailable)
+        self.assertEqual(2, self.shardSeats())
+        self.assertRaises(ConflictException, self.update, maxAttendees=2)
+        self.assertEqual(2, self.shardSeats())
+
+    def testRenameDoesNotReadSeatShards(self):
+        get_seats = ConferenceApi._getSeatsAvailable
+        ConferenceApi._getSeatsAvailable = staticmethod(
+            lambda conf: self.fail('read the seat shards'))
+        try:
+            self.assertEqual('Renamed', self.update(name='Renamed').name)
+            self.assertEqual('Again',
+                self.update(name='Again', seatsAvailable=20).name)
+        finally:
+            ConferenceApi._getSeatsAvailable = staticmethod(get_seats)
+
+    def testSeatsAvailableCantBeEdited(self):
+        self.assertRaises(endpoints.BadRequestException,
+            self.update, seatsAvailable=100)
+        # echoing the current value back is not an edit
+        self.assertEqual('Renamed',
+            self.update(name='Renamed', seatsAvailable=20).name)
+        self.assertEqual(20, self.shardSeats())
+
+    def testSeatChangeErrorsAreNotRaised(self):
+        def fail(c_key, delta):
+            raise datastore_errors.Timeout()
+        apply_change = ConferenceApi._applySeatsChange
+        ConferenceApi._applySeatsChange = staticmethod(fail)
+        try:
+            # the registration committed before the seat change failed
+            self.login('attendee@example.com')
+            self.assertTrue(self.register())
+        finally:
+            ConferenceApi._applySeatsChange = staticmethod(apply_change)
+        self.assertEqual(1, self.attendees())
+        self.assertEqual(19, self.shardSeats())
+
+
+class LowSeatsTest(TestCase):
+
+    def setUp(self):
+        super(LowSeatsTest, self).setUp()
+        self.conf_key = self.createConference(name='PyCon', maxAttendees=7)
+        self.wsck = self.conf_key.urlsafe()
+        self.registrants = 0
+
+    def register(self):
+        self.registrants += 1
+        self.login('attendee%d@example.com' % self.registrants)
+        return self.api().registerForConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck)).data
+
+    def unregister(self):
+        self.login('attendee%d@example.com' % self.registrants)
+        self.registrants -= 1
+        return self.api().unregisterFromConference(
+            conference.CONF_GET_REQUEST.combined_message_class(
+                websafeConferenceKey=self.wsck)).data
+
+    def lowSeats(self):
+        low = ndb.Key(LowSeatsIndex, conference.LOW_SEATS_INDEX_ID).get()
+        return low.conferences if low else {}
+
+    def announcement(self):
+        return memcache.get(conference.MEMCACHE_ANNOUNCEMENTS_KEY)
+
+    def testConferenceEntersBandAtThreshold(self):
+        self.register()
+        self.assertEqual({}, self.lowSeats())
+        self.assertEqual(None, self.announcement())
+        self.register()
+        self.assertEqual({self.wsck: 'PyCon'}, self.lowSeats())
+        self.assertTrue(self.announcement().endswith('nearly sold out: PyCon'))
+
+    def testSoldOutConferenceLeavesBand(self):
+        for i in range(6):
+            self.register()
+        self.assertEqual({self.wsck: 'PyCon'}, self.lowSeats())
+        self.register()
+        self.assertEqual({}, self.lowSeats())
+        self.assertEqual("", self.announcement())
+        # a seat freed by an unregistration brings it back
+        self.unregister()
+        self.assertEqual({self.wsck: 'PyCon'}, self.lowSeats())
+        self.assertTrue(self.announcement().endswith('nearly sold out: PyCon'))
+
+    def testAnnouncementListsEveryNearlySoldOutConference(self):
+        self.login('organizer@example.com')
+        other = self.createConference(name='DjangoCon', maxAttendees=6)
+        for i in range(2):
+            self.register()
+        self.wsck = other.urlsafe()
+        self.register()
+        self.assertEqual({self.conf_key.urlsafe(): 'PyCon', self.wsck: 'DjangoCon'},
+                         self.lowSeats())
+        self.assertTrue(
+            self.announcement().endswith('nearly sold out: DjangoCon, PyCon'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""Tests that conference list endpoints read each result set once."""
+
+import unittest
+
+from protorpc import message_types
+from google.appengine.ext import ndb
+
+from tests.base import TestCase
+from models import ConferenceQueryForms
+
+
+class ConferenceListRpcTest(TestCase):
+
+    def setUp(self):
+        super(ConferenceListRpcTest, self).setUp()
+        # count the datastore reads themselves, not ndb's memcache hits
+        ndb.get_context().set_memcache_policy(False)
+        self.api().getProfile(message_types.VoidMessage())
+        self.conf_keys = [self.createConference(name='Conf %d' % i, city='Paris')
+                          for i in range(3)]
+
+    def forgetOrganizerNames(self):
+        # conferences saved before they stored the organizer's name
+        for conf_key in self.conf_keys:
+            conf = conf_key.get()
+            conf.organizerDisplayName = None
+            conf.put()
+
+    def testGetConferencesCreated(self):
+        with self.recordRpcs() as calls:
+            forms = self.api().getConferencesCreated(message_types.VoidMessage())
+        self.assertEqual(3, len(forms.items))
+        self.assertEqual(1, self.datastoreCalls(calls, 'RunQuery'))
+        self.assertEqual(0, self.datastoreCalls(calls, 'Get'))
+
+    def testGetConferencesCreatedReadsOldOrganizerOnce(self):
+        self.forgetOrganizerNames()
+        with self.recordRpcs() as calls:
+            forms = self.api().getConferencesCreated(message_types.VoidMessage())
+        self.assertEqual(set([self.user.nickname()]),
+                         set(cf.organizerDisplayName for cf in forms.items))
+        self.assertEqual(1, self.datastoreCalls(calls, 'RunQuery'))
+        self.assertEqual(1, self.datastoreCalls(calls, 'Get'))
+
+    def testQueryConferences(self):
+        self.forgetOrganizerNames()
+        with self.recordRpcs() as calls:
+            forms = self.api().queryConferences(ConferenceQueryForms())
+        self.assertEqual(3, len(forms.items))
+        self.assertEqual(1, self.datastoreCalls(calls, 'RunQuery'))
+        # the FieldStats read by query planning, then the one organizer
+        self.assertEqual(2, self.datastoreCalls(calls, 'Get'))
+
+
+class CreateSessionRpcTest(TestCase):
+
+    def testCreatedSessionIsNotReadBack(self):
+        self.api().getProfile(message_types.VoidMessage())
+        conf_key = self.createConference(name='PyCon')
+        with self.recordRpcs() as calls:
+            form = self.createSession(conf_key, name='Intro', speaker='Jane Doe',
+                duration=30, date='2026-06-01', startTime='09:00')
+        self.assertEqual('Intro', form.name)
+        self.assertTrue(form.websafeSessionKey)
+        self.assertEqual(1, self.datastoreCalls(calls, 'AllocateIds'))
+        self.assertEqual(1, self.datastoreCalls(calls, 'Commit'))
+        # nothing is read from the datastore once the session is saved
+        committed = calls.index(('datastore_v3', 'Commit'))
+        self.assertNotIn(('datastore_v3', 'Get'), calls[committed:])
+
+
+if __name__ == '__main__':
+    unittest.main()
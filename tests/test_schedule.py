@@ -0,0 +1,113 @@
+"""Tests for the schedule timeline: sessions at a time and wishlist clashes."""
+
+import unittest
+
+import endpoints
+from google.appengine.ext import ndb
+
+import conference
+from tests.base import TestCase
+from conference import ConferenceApi
+from models import Conference
+from models import Profile
+from models import ScheduleTimeline
+from models import WishListRequestForm
+
+
+class ScheduleTest(TestCase):
+
+    def setUp(self):
+        super(ScheduleTest, self).setUp()
+        self.conf_key = self.createConference(name='PyCon')
+        # 09:00-10:00, 09:30-11:00, 10:00-10:30 and an all day session
+        self.a = self.createSession(self.conf_key, name='A', date='2026-06-01',
+            startTime='09:00', duration=60).websafeSessionKey
+        self.b = self.createSession(self.conf_key, name='B', date='2026-06-01',
+            startTime='09:30', duration=90).websafeSessionKey
+        self.c = self.createSession(self.conf_key, name='C', date='2026-06-01',
+            startTime='10:00', duration=30).websafeSessionKey
+        self.d = self.createSession(self.conf_key, name='D', date='2026-06-02',
+            startTime='00:00', duration=24 * 60).websafeSessionKey
+
+    def sessionsAt(self, time, conf_key=None):
+        request = conference.SESSIONS_AT_REQUEST.combined_message_class(
+            websafeConferenceKey=(conf_key or self.conf_key).urlsafe(), time=time)
+        return sorted(sf.name for sf in self.api().getSessionsAt(request).sessions)
+
+    def testSessionsAt(self):
+        self.assertEqual([], self.sessionsAt('2026-06-01 08:59'))
+        self.assertEqual(['A'], self.sessionsAt('2026-06-01 09:00'))
+        self.assertEqual(['A', 'B'], self.sessionsAt('2026-06-01 09:45'))
+        self.assertEqual(['B', 'C'], self.sessionsAt('2026-06-01 10:00'))
+        self.assertEqual([], self.sessionsAt('2026-06-01 11:00'))
+        self.assertEqual(['D'], self.sessionsAt('2026-06-02T23:59'))
+
+    def testTimelineStoresEachSessionOnce(self):
+        timeline = ndb.Key(ScheduleTimeline, 'timeline', parent=self.conf_key).get()
+        self.assertEqual(4, len(timeline.intervals))
+        self.assertEqual(4, len(timeline.maxEnd))
+
+    def testUnknownConferenceIsNotWritten(self):
+        missing = ndb.Key(Conference, 12345,
+            parent=ndb.Key(Profile, 'organizer@example.com'))
+        self.assertRaises(endpoints.NotFoundException,
+            self.sessionsAt, '2026-06-01 09:00', missing)
+        self.assertEqual(1, ScheduleTimeline.query().count())
+
+    def testLegacyConferenceIsReadWithoutWriting(self):
+        ndb.Key(ScheduleTimeline, 'timeline', parent=self.conf_key).delete()
+        self.assertEqual(['A', 'B'], self.sessionsAt('2026-06-01 09:45'))
+        self.assertEqual(0, ScheduleTimeline.query().count())
+
+    def testIndexTimelinesSavesMissingTimelines(self):
+        ndb.Key(ScheduleTimeline, 'timeline', parent=self.conf_key).delete()
+        empty_key = self.createConference(name='Empty')
+        ConferenceApi._indexTimelines()
+        timeline = ndb.Key(ScheduleTimeline, 'timeline', parent=self.conf_key).get()
+        self.assertEqual(4, len(timeline.intervals))
+        # a conference without sessions is saved too, so reads stop querying
+        self.assertEqual([], ndb.Key(ScheduleTimeline, 'timeline', parent=empty_key).get().intervals)
+        with self.recordRpcs() as calls:
+            self.assertEqual(['A', 'B'], self.sessionsAt('2026-06-01 09:45'))
+        self.assertEqual(0, self.datastoreCalls(calls, 'RunQuery'))
+
+    def testIndexTimelinesQueuesNextBatch(self):
+        batch_size = conference.QUERY_BATCH_SIZE
+        conference.QUERY_BATCH_SIZE = 1
+        try:
+            self.createConference(name='Other')
+            ndb.delete_multi(ScheduleTimeline.query().fetch(keys_only=True))
+            ConferenceApi._indexTimelines()
+            tasks = self.popTasks('/tasks/index_timelines')
+            self.assertEqual(1, len(tasks))
+            ConferenceApi._indexTimelines(tasks[0]['cursor'])
+        finally:
+            conference.QUERY_BATCH_SIZE = batch_size
+        self.assertEqual(2, ScheduleTimeline.query().count())
+
+    def testWishlistConflicts(self):
+        self.api().addSessionToWishlist(WishListRequestForm(sessionKeys=[self.a]))
+        result = self.api().addSessionToWishlist(
+            WishListRequestForm(sessionKeys=[self.b, self.d]))
+        self.assertEqual(3, len(result.sessions))
+        self.assertEqual([(self.b, [self.a])],
+            [(c.websafeSessionKey, c.conflictingSessionKeys) for c in result.conflicts])
+
+        # checking C against the wishlist before adding it
+        conflicts = self.api().getScheduleConflicts(
+            WishListRequestForm(sessionKeys=[self.c])).items
+        self.assertEqual([(self.c, [self.b])],
+            [(c.websafeSessionKey, c.conflictingSessionKeys) for c in conflicts])
+
+    def testTimelineSearchMatchesScan(self):
+        timeline = ConferenceApi._buildTimeline(ScheduleTimeline(),
+            [[s, s + (s * 7) % 50 + 1, s] for s in range(0, 300, 3)])
+        for start in range(-5, 360, 11):
+            end = start + 17
+            expected = [i[2] for i in timeline.intervals if i[0] < end and i[1] > start]
+            self.assertEqual(expected,
+                ConferenceApi._timelineSearch(timeline, start, end))
+
+
+if __name__ == '__main__':
+    unittest.main()
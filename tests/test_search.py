@@ -0,0 +1,58 @@
+"""Tests for searchConferences ranking, paging and the ranked key cache."""
+
+import unittest
+
+import endpoints
+from google.appengine.ext import ndb
+
+import conference
+from tests.base import TestCase
+from models import SearchDocument
+
+
+class SearchTest(TestCase):
+
+    def search(self, query, **fields):
+        return self.api().searchConferences(
+            conference.SEARCH_REQUEST.combined_message_class(query=query, **fields))
+
+    def testRankedAndPaged(self):
+        self.createConference(name='Web Days', description='python talks')
+        self.createConference(name='Python Web', description='the web')
+        self.createConference(name='Rust Conf', description='no snakes')
+
+        first = self.search('python web', limit=1)
+        self.assertEqual(['Python Web'], [cf.name for cf in first.items])
+        second = self.search('python web', limit=1, pageToken=first.nextPageToken)
+        self.assertEqual(['Web Days'], [cf.name for cf in second.items])
+        self.assertFalse(second.nextPageToken)
+
+    def testLaterPagesReadTheCachedRanking(self):
+        for i in range(3):
+            self.createConference(name='Python %d' % i)
+        first = self.search('python', limit=2)
+        self.assertEqual(2, len(first.items))
+
+        # with the documents gone only the cached ranking can find these
+        ndb.delete_multi(SearchDocument.query().fetch(keys_only=True))
+        second = self.search('python', limit=2, pageToken=first.nextPageToken)
+        self.assertEqual(1, len(second.items))
+        self.assertNotIn(second.items[0].name, [cf.name for cf in first.items])
+
+    def testOverlongTermsAreNotIndexed(self):
+        long_word = u'\u00e9' * 300     # 600 bytes in utf-8
+        conf_key = self.createConference(name='Python',
+            description=' '.join([long_word, 'x' * 501, 'talks']))
+        doc = ndb.Key(SearchDocument, 'text', parent=conf_key).get()
+        self.assertIn('talks', doc.terms)
+        self.assertEqual([], [term for term in doc.terms if len(term) > 10])
+        self.assertEqual(['Python'], [cf.name for cf in self.search('talks').items])
+
+    def testNegativePageTokenIsRejected(self):
+        self.createConference(name='Python')
+        self.assertRaises(endpoints.BadRequestException,
+            self.search, 'python', pageToken='-1')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Tests for session queries filtered on several fields."""
+
+import unittest
+
+import endpoints
+
+from tests.base import TestCase
+from models import SessionQueryForms
+
+# models.SessionQueryForm is redefined further down as the by-type/speaker
+# request, so take the filter message from the form that holds it
+SessionFilterForm = SessionQueryForms.filters.type
+
+
+class SessionQueryTest(TestCase):
+
+    def setUp(self):
+        super(SessionQueryTest, self).setUp()
+        conf_key = self.createConference(name='PyCon')
+        for name, duration, start in [('A', 5, '09:00'), ('B', 30, '10:00'),
+                                      ('C', 120, '09:00'), ('D', 45, '19:00')]:
+            self.createSession(conf_key, name=name, duration=duration,
+                startTime=start, typeOfSession='talk')
+
+    def query(self, *filters, **fields):
+        return self.api().getSessionsTwoInequality(SessionQueryForms(
+            filters=[SessionFilterForm(field=f, operator=o, value=v)
+                     for f, o, v in filters], **fields))
+
+    def testInequalitiesOnTwoFields(self):
+        # as strings "120" and "30" would both sort below "9"
+        forms = self.query(('DURATION', 'GT', '9'), ('STARTTIME', 'LT', '12:00'))
+        self.assertEqual(['B', 'C'], sorted(sf.name for sf in forms.sessions))
+
+    def testExplainShowsOneFieldPushedDown(self):
+        forms = self.query(('DURATION', 'GT', '9'), ('STARTTIME', 'LT', '12:00'),
+            ('TYPEOFSESSION', 'EQ', 'talk'), explain=True)
+        self.assertEqual(['B', 'C'], sorted(sf.name for sf in forms.sessions))
+        pushed = set(p.field for p in forms.plan if p.pushedDown)
+        self.assertEqual(1, len(pushed))
+
+    def testBadValueIsRejected(self):
+        self.assertRaises(endpoints.BadRequestException, self.query,
+            ('DURATION', 'GT', 'long'), ('STARTTIME', 'LT', '12:00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
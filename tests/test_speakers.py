@@ -0,0 +1,66 @@
+"""Tests for speaker names and the featured speaker index."""
+
+from datetime import date
+import unittest
+
+from google.appengine.ext import ndb
+
+from tests.base import TestCase
+from conference import ConferenceApi
+from models import Session
+from models import SessionQueryForm
+from models import SpeakerSessions
+
+
+class FeaturedSpeakerTest(TestCase):
+
+    def setUp(self):
+        super(FeaturedSpeakerTest, self).setUp()
+        self.conf_key = self.createConference(name='PyCon')
+
+    def testSpellingVariantsShareAnEntry(self):
+        self.createSession(self.conf_key, name='Intro', speaker='Dr. Jane Doe')
+        self.createSession(self.conf_key, name='Advanced', speaker='dr jane  doe')
+
+        entries = SpeakerSessions.query(ancestor=self.conf_key).fetch()
+        self.assertEqual(['dr jane doe'], [idx.key.id() for idx in entries])
+        self.assertEqual(['Intro', 'Advanced'], entries[0].sessionNames)
+        announcement = ConferenceApi._featuredSpeaker('DR JANE DOE',
+            self.conf_key.urlsafe())
+        self.assertIn('Intro, Advanced', announcement)
+
+    def testLegacyEntryIsReplaced(self):
+        self.createSession(self.conf_key, name='Intro', speaker='Dr. Jane Doe')
+        # an entry keyed by the raw name, as they were first written
+        entry = ndb.Key(SpeakerSessions, 'dr jane doe', parent=self.conf_key).get()
+        entry.key.delete()
+        SpeakerSessions(key=ndb.Key(SpeakerSessions, 'Dr. Jane Doe', parent=self.conf_key),
+            speaker='Dr. Jane Doe', sessionNames=['Intro']).put()
+
+        self.createSession(self.conf_key, name='Advanced', speaker='Dr. Jane Doe')
+        entries = SpeakerSessions.query(ancestor=self.conf_key).fetch()
+        self.assertEqual(['dr jane doe'], [idx.key.id() for idx in entries])
+        self.assertEqual(['Intro', 'Advanced'], entries[0].sessionNames)
+
+
+class SpeakerSessionsTest(TestCase):
+
+    def bySpeaker(self, speaker):
+        request = SessionQueryForm(speaker=speaker)
+        return [sf.name for sf in self.api().getConferenceSessionsBySpeaker(request).sessions]
+
+    def testUnlinkedSessionsAreFound(self):
+        conf_key = self.createConference(name='PyCon')
+        self.createSession(conf_key, name='Intro', speaker='Jane Doe',
+            date='2026-06-02')
+        # saved before sessions were linked to Speaker entities
+        Session(parent=conf_key, name='Legacy', speaker='Jane Doe',
+            date=date(2026, 6, 1)).put()
+        self.assertEqual(['Legacy', 'Intro'], self.bySpeaker('Jane Doe'))
+
+        ConferenceApi._indexSpeakers()
+        self.assertEqual(['Legacy', 'Intro'], self.bySpeaker('Jane Doe'))
+
+
+if __name__ == '__main__':
+    unittest.main()
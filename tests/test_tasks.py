@@ -0,0 +1,105 @@
+"""Tests for the batched confirmation emails and the deduplicated featured
+speaker task."""
+
+import time
+import unittest
+
+from google.appengine.api import mail
+from google.appengine.api import taskqueue
+
+from tests.base import TestCase
+# tests.base puts the SDK's libraries, webapp2 among them, on sys.path
+from google.appengine.ext import testbed
+import webapp2
+
+import main
+from conference import CONFIRMATION_EMAIL_QUEUE
+
+
+class ConfirmationEmailsTest(TestCase):
+
+    def setUp(self):
+        super(ConfirmationEmailsTest, self).setUp()
+        self.mail = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+        self.createConference(name='PyCon')
+        self.createConference(name='DjangoCon')
+        self.login('other@example.com')
+        self.createConference(name='RustConf')
+
+    def sendEmails(self):
+        response = webapp2.Request.blank(
+            '/crons/send_confirmation_emails').get_response(main.app)
+        self.assertEqual(200, response.status_int)
+
+    def queued(self):
+        return self.taskqueue.get_filtered_tasks(
+            queue_names=[CONFIRMATION_EMAIL_QUEUE])
+
+    def testOneEmailPerOrganizer(self):
+        self.assertEqual(3, len(self.queued()))
+        self.sendEmails()
+        messages = self.mail.get_sent_messages(to='organizer@example.com')
+        self.assertEqual(1, len(messages))
+        body = messages[0].body.decode()
+        self.assertIn('PyCon', body)
+        self.assertIn('DjangoCon', body)
+        messages = self.mail.get_sent_messages(to='other@example.com')
+        self.assertEqual(1, len(messages))
+        self.assertIn('RustConf', messages[0].body.decode())
+        # sent confirmations are deleted, so the next run sends nothing
+        self.assertEqual([], self.queued())
+        self.sendEmails()
+        self.assertEqual(2, len(self.mail.get_sent_messages()))
+
+    def testLeasesInBatches(self):
+        batch = main.CONFIRMATION_EMAIL_BATCH
+        main.CONFIRMATION_EMAIL_BATCH = 2
+        try:
+            self.sendEmails()
+        finally:
+            main.CONFIRMATION_EMAIL_BATCH = batch
+        # every batch is leased, sent and deleted
+        self.assertEqual([], self.queued())
+        bodies = ''.join(m.body.decode() for m in self.mail.get_sent_messages())
+        for name in ('PyCon', 'DjangoCon', 'RustConf'):
+            self.assertIn(name, bodies)
+
+    def testFailedEmailStaysLeased(self):
+        send_mail = main.mail.send_mail
+        def fail_for_other(sender, to, subject, body):
+            if to == 'other@example.com':
+                raise mail.InvalidEmailError()
+            return send_mail(sender, to, subject, body)
+        main.mail.send_mail = fail_for_other
+        try:
+            self.sendEmails()
+        finally:
+            main.mail.send_mail = send_mail
+        self.assertEqual(1, len(self.mail.get_sent_messages()))
+        # RustConf's confirmation is left for when its lease runs out
+        queue = taskqueue.Queue(CONFIRMATION_EMAIL_QUEUE)
+        self.assertEqual(1, len(self.queued()))
+        self.assertEqual([], queue.lease_tasks(main.CONFIRMATION_EMAIL_LEASE, 10))
+
+
+class FeaturedSpeakerTaskTest(TestCase):
+
+    def testOneTaskPerConferenceAndInterval(self):
+        conf_key = self.createConference(name='PyCon')
+        other_key = self.createConference(name='DjangoCon')
+        now = time.time
+        # in the middle of one interval, whenever the test runs
+        time.time = lambda: 1000000005.0
+        try:
+            self.createSession(conf_key, name='Intro', speaker='Jane Doe')
+            self.createSession(conf_key, name='Advanced', speaker='Jane Doe')
+            self.createSession(other_key, name='Keynote', speaker='Jane Doe')
+        finally:
+            time.time = now
+        tasks = self.popTasks('/tasks/setFeaturedSpeaker')
+        self.assertEqual(sorted([conf_key.urlsafe(), other_key.urlsafe()]),
+                         sorted(task['websafeConferenceKey'] for task in tasks))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Tests for the oauth tokeninfo lookup in utils, against a stub fetcher."""
+
+import json
+import os
+import unittest
+
+from google.appengine.api import urlfetch
+
+import utils
+from tests.base import TestCase
+
+
+class TokenInfoTest(TestCase):
+
+    def setUp(self):
+        super(TokenInfoTest, self).setUp()
+        self.responses = []
+        self.urls = []
+        utils.setTokenInfoFetcher(self.fetch)
+        utils._tokenCache.clear()
+        self._backoff = utils.TOKENINFO_BACKOFF
+        utils.TOKENINFO_BACKOFF = 0
+        os.environ['HTTP_AUTHORIZATION'] = 'Bearer token-1'
+
+    def tearDown(self):
+        utils.setTokenInfoFetcher(None)
+        utils._tokenCache.clear()
+        utils.TOKENINFO_BACKOFF = self._backoff
+        os.environ.pop('HTTP_AUTHORIZATION', None)
+        super(TokenInfoTest, self).tearDown()
+
+    def fetch(self, url):
+        self.urls.append(url)
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def ok(self, **info):
+        info.setdefault('user_id', '42')
+        return 200, json.dumps(info)
+
+    def testLookupIsCached(self):
+        self.responses = [self.ok(expires_in=600)]
+        self.assertEqual('42', utils.getUserId(self.user, 'oauth'))
+        self.assertEqual('42', utils.getUserId(self.user, 'oauth'))
+        # a new instance only has memcache
+        utils._tokenCache.clear()
+        self.assertEqual('42', utils.getUserId(self.user, 'oauth'))
+        self.assertEqual(1, len(self.urls))
+
+    def testFailuresAreRetried(self):
+        self.responses = [(500, ''), (503, ''), self.ok()]
+        self.assertEqual('42', utils.getUserId(self.user, 'oauth'))
+        self.assertEqual(3, len(self.urls))
+
+    def testTransportErrorsAreRetried(self):
+        self.responses = [urlfetch.DeadlineExceededError(),
+                          urlfetch.DownloadError(), self.ok()]
+        self.assertEqual('42', utils.getUserId(self.user, 'oauth'))
+        self.assertEqual(3, len(self.urls))
+
+    def testGivesUpAfterTransportErrors(self):
+        self.responses = [urlfetch.DownloadError()] * utils.TOKENINFO_RETRIES
+        self.assertEqual('', utils.getUserId(self.user, 'oauth'))
+
+    def testGivesUpAfterRetries(self):
+        self.responses = [(500, '')] * utils.TOKENINFO_RETRIES
+        self.assertEqual('', utils.getUserId(self.user, 'oauth'))
+        # a failed lookup is not cached
+        self.responses = [self.ok()]
+        self.assertEqual('42', utils.getUserId(self.user, 'oauth'))
+
+    def testInvalidIdTokenTriesAccessToken(self):
+        self.responses = [(400, '{"error": "invalid_token"}'), self.ok()]
+        self.assertEqual('42', utils.getUserId(self.user, 'oauth'))
+        self.assertIn('id_token=token-1', self.urls[0])
+        self.assertIn('access_token=token-1', self.urls[1])
+
+    def testExpiredTokenIsNotCached(self):
+        self.responses = [self.ok(expires_in=0), self.ok(user_id='43')]
+        self.assertEqual('42', utils.getUserId(self.user, 'oauth'))
+        self.assertEqual('43', utils.getUserId(self.user, 'oauth'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,128 @@
+import collections
+import hashlib
 import json
 import os
+import threading
 import time
 import uuid
 
+from google.appengine.api import memcache
 from google.appengine.api import urlfetch
+from google.appengine.runtime import apiproxy_errors
 from models import Profile
 
+# tokeninfo lookups for the oauth id_type; point TOKENINFO_URL at a local
+# stub server, or swap the fetcher with setTokenInfoFetcher(), to test offline
+TOKENINFO_URL = 'https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
+TOKENINFO_DEADLINE = 5          # seconds per fetch
+# getUserId has to return the user_id, so the backoff between retries
+# blocks the request: at most 0.1 + 0.2 seconds with these values
+TOKENINFO_RETRIES = 3
+TOKENINFO_BACKOFF = 0.1         # seconds, doubled after each failure
+TOKENINFO_MAX_BACKOFF = 0.4     # seconds
+TOKENINFO_MAX_TTL = 3600        # seconds a token -> user_id entry is kept
+TOKENINFO_CACHE_SIZE = 1000     # entries in the in-process cache
+MEMCACHE_TOKENINFO_KEY = "TOKENINFO:%s"
+
+
+def fetchTokenInfo(url):
+    """Fetch url and return (status_code, content); the default fetcher."""
+    rpc = urlfetch.create_rpc(deadline=TOKENINFO_DEADLINE)
+    urlfetch.make_fetch_call(rpc, url)
+    resp = rpc.get_result()
+    return resp.status_code, resp.content
+
+_tokenInfoFetcher = fetchTokenInfo
+
+
+def setTokenInfoFetcher(fetcher):
+    """Replace the tokeninfo fetcher, a callable url -> (status, content).
+    Passing None restores the urlfetch based default."""
+    global _tokenInfoFetcher
+    _tokenInfoFetcher = fetcher or fetchTokenInfo
+
+
+class TokenCache(object):
+    """TokenCache -- small thread-safe LRU of token digest -> user_id,
+    where every entry expires at its own time"""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        """Return the user_id for digest, or None if missing or expired."""
+        with self._lock:
+            item = self._items.pop(digest, None)
+            if item is None or item[1] <= time.time():
+                return None
+            self._items[digest] = item      # most recently used goes last
+            return item[0]
+
+    def set(self, digest, user_id, expires_at):
+        """Remember user_id for digest until the expires_at timestamp."""
+        with self._lock:
+            self._items.pop(digest, None)
+            self._items[digest] = (user_id, expires_at)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+_tokenCache = TokenCache(TOKENINFO_CACHE_SIZE)
+
+
+def _getOAuthUserId(token):
+    """Return the user_id a token belongs to, via the in-process cache,
+    then memcache, then the tokeninfo endpoint."""
+    # keep raw tokens out of cache keys
+    digest = hashlib.sha256(token).hexdigest()
+    user_id = _tokenCache.get(digest)
+    if user_id:
+        return user_id
+
+    cache_key = MEMCACHE_TOKENINFO_KEY % digest
+    cached = memcache.get(cache_key)
+    if cached:
+        user_id, expires_at = cached
+        _tokenCache.set(digest, user_id, expires_at)
+        return user_id
+
+    token_type = 'id_token'
+    if 'OAUTH_USER_ID' in os.environ:
+        token_type = 'access_token'
+    user = {}
+    wait = TOKENINFO_BACKOFF
+    for i in range(TOKENINFO_RETRIES):
+        try:
+            status, content = _tokenInfoFetcher(TOKENINFO_URL % (token_type, token))
+        except (urlfetch.Error, apiproxy_errors.DeadlineExceededError):
+            # the endpoint didn't answer in time; retry like a 5xx
+            status, content = None, ''
+        if status == 200:
+            user = json.loads(content)
+            break
+        elif status == 400 and 'invalid_token' in content:
+            # not a failure of the endpoint; ask again straight away
+            token_type = 'access_token'
+        elif i < TOKENINFO_RETRIES - 1:
+            time.sleep(wait)
+            wait = min(wait * 2, TOKENINFO_MAX_BACKOFF)
+
+    user_id = user.get('user_id', '')
+    if user_id:
+        # never keep a user_id around longer than the token is valid
+        ttl = min(int(user.get('expires_in', TOKENINFO_MAX_TTL)), TOKENINFO_MAX_TTL)
+        if ttl > 0:
+            expires_at = time.time() + ttl
+            _tokenCache.set(digest, user_id, expires_at)
+            memcache.set(cache_key, (user_id, expires_at), time=ttl)
+    return user_id
+
+
 def getUserId(user, id_type="email"):
     if id_type == "email":
         return user.email()
@@ -14,25 +131,7 @@ def getUserId(user, id_type="email"):
         """A workaround implementation for getting userid."""
         auth = os.getenv('HTTP_AUTHORIZATION')
         bearer, token = auth.split()
-        token_type = 'id_token'
-        if 'OAUTH_USER_ID' in os.environ:
-            token_type = 'access_token'
-        url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-               % (token_type, token))
-        user = {}
-        wait = 1
-        for i in range(3):
-            resp = urlfetch.fetch(url)
-            if resp.status_code == 200:
-                user = json.loads(resp.content)
-                break
-            elif resp.status_code == 400 and 'invalid_token' in resp.content:
-                url = ('https://www.googleapis.com/oauth2/v1/tokeninfo?%s=%s'
-                       % ('access_token', token))
-            else:
-                time.sleep(wait)
-                wait = wait + i
-        return user.get('user_id', '')
+        return _getOAuthUserId(token)
 
     if id_type == "custom":
         # implement your own user_id creation and getting algorythm